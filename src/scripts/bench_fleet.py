@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+#
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except
+# in compliance with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the License
+# is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+# or implied. See the License for the specific language governing permissions and limitations under
+# the License.
+
+""" End to end fleet benchmark against fake_compute.py
+
+For every fleet size a fresh fake project is served from a child process.
+The real GCEHelper and DenovoHelper code brings the fleet up, submits one
+job per core and refreshes the job states. Host commands go to the
+simulated hosts of the fake server instead of over ssh.
+"""
+
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+import urllib2
+from contextlib import contextmanager
+
+from fabric.api import abort, env
+
+import denovo_helper
+import fake_compute
+import gce_helper
+import ssh_session
+import utils
+
+SSH_URL = None
+
+
+def fake_ssh(host, cmd, timeout=None):
+    """ Run cmd on a simulated host, failing like a remote command would """
+    try:
+        return urllib2.urlopen(SSH_URL + host, cmd, timeout=60).read()
+    except urllib2.HTTPError as e:
+        abort("{0}: {1}".format(host, e))
+
+
+def fake_run(cmd, *args, **kwargs):
+    """ Stand-in for fabric's run on the current host """
+    return fake_ssh(env.host, cmd)
+
+
+@contextmanager
+def quiet():
+    """ Hide the per host output of the tasks """
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    try:
+        yield
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+
+def bench_size(num_hosts, args):
+    """ Bring up num_hosts fake hosts, submit jobs and refresh their state """
+    global SSH_URL
+    tmpdir = tempfile.mkdtemp(prefix="bench-fleet-")
+    fake = fake_compute.FakeCompute(
+        latency=fake_compute.parse_rates(args.latency),
+        failure_rate=fake_compute.parse_rates(args.failure_rate),
+        api_latency=args.api_latency, ssh_latency=args.ssh_latency)
+    server = fake_compute.FakeServer(fake)
+    child = multiprocessing.Process(target=server.serve_forever)
+    child.daemon = True
+    child.start()
+    server.socket.close()
+
+    SSH_URL = server.ssh_url()
+    utils.constants.update({
+        "COMPUTE_BASE_URL": server.base_url(),
+        "JOB_TABLE": os.path.join(tmpdir, "jobs.tbl"),
+        "INVENTORY_CACHE": os.path.join(tmpdir, "inventory.json"),
+    })
+    helper = gce_helper.GCEHelper()
+    denovo = denovo_helper.DenovoHelper(helper)
+    result = {"hosts": num_hosts}
+    try:
+        start = time.time()
+        with quiet():
+            created = helper.gce_create_denovo_instances(
+                num_instances=num_hosts, num_cores=args.num_cores,
+                parallel=True, max_parallel=args.max_parallel,
+                inline=args.provision == "inline",
+                bulk=args.provision == "bulk")
+        result["bringup_seconds"] = time.time() - start
+        result["created"] = sum(1 for outcome in created.values()
+                                if outcome == "CREATED")
+        helper._updateNameToIPMap()
+        result["reachable"] = len(helper.nameToIPMap)
+        if result["created"] and not result["reachable"]:
+            raise RuntimeError("{0:d} hosts created but none reachable".
+                               format(result["created"]))
+
+        num_jobs = result["created"] * args.num_cores
+        denovo._table_enqueue(
+            [denovo_helper.DenovoBuilder.java_string +
+             "stage1 --chromosome chr{0:d} --output_file job{1:d}.calls".
+             format(job % 22 + 1, job) for job in xrange(num_jobs)],
+            [1] * num_jobs)
+        start = time.time()
+        with quiet():
+            denovo._schedule_once(args.pool_size)
+        result["submit_seconds"] = time.time() - start
+        with denovo_helper.JobTable() as tbl:
+            result["submitted"] = len(tbl.get_jobs_by_status("submitted"))
+        if num_jobs and not result["submitted"]:
+            raise RuntimeError("{0:d} jobs queued but none submitted".format(
+                num_jobs))
+
+        start = time.time()
+        with quiet():
+            denovo.fleet_table_update_jobs(args.pool_size)
+        result["refresh_seconds"] = time.time() - start
+    finally:
+        helper.client.close()
+        denovo_helper.JobTable.close_all()
+        child.terminate()
+        child.join()
+        shutil.rmtree(tmpdir)
+    return result
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+    parser = ArgumentParser(description="Benchmark fleet operations")
+    parser.add_argument("--sizes", type=str, default="10,100,1000",
+                        help="Comma separated numbers of hosts")
+    parser.add_argument("--num_cores", type=int, default=4)
+    parser.add_argument("--max_parallel", type=int, default=50,
+                        help="Instance creations in flight")
+    parser.add_argument("--provision", type=str, default="separate",
+                        choices=["separate", "inline", "bulk"],
+                        help="Disk then instance, inline boot disks or "
+                        "bulkInsert")
+    parser.add_argument("--pool_size", type=int, default=50,
+                        help="Hosts worked on at once")
+    parser.add_argument("--latency", type=str,
+                        default="insert_disk=1,insert_instance=2,"
+                        "bulk_insert_instance=4",
+                        help="Operation seconds, e.g. insert_instance=5")
+    parser.add_argument("--failure_rate", type=str, default="",
+                        help="Operation failure rates, e.g. insert_disk=0.01")
+    parser.add_argument("--api_latency", type=float, default=0.02,
+                        help="Seconds added to every API request")
+    parser.add_argument("--ssh_latency", type=float, default=0.02,
+                        help="Seconds added to every host command")
+    parser.add_argument("--output", type=str, default=None,
+                        help="Also write the results as json")
+    args = parser.parse_args()
+
+    denovo_helper.run = fake_run
+    ssh_session.mux_run = fake_ssh
+    env.abort_on_prompts = True
+
+    results = []
+    print "{0:>6} {1:>10} {2:>8} {3:>10} {4:>8} {5:>10}".format(
+        "hosts", "bring-up", "hosts/s", "submit", "jobs/s", "refresh")
+    for num_hosts in map(int, args.sizes.split(",")):
+        result = bench_size(num_hosts, args)
+        results.append(result)
+        print "{hosts:>6d} {bringup_seconds:>9.1f}s {0:>8.1f} " \
+            "{submit_seconds:>9.1f}s {1:>8.1f} {refresh_seconds:>9.2f}s".\
+            format(result["created"] / result["bringup_seconds"],
+                   result["submitted"] / max(result["submit_seconds"], 1e-9),
+                   **result)
+    if args.output:
+        with open(args.output, "w") as fout:
+            json.dump(results, fout, indent=2, sort_keys=True)
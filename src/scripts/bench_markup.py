@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+#
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except
+# in compliance with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the License
+# is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+# or implied. See the License for the specific language governing permissions and limitations under
+# the License.
+
+""" Microbenchmarks for markup.py and job table rendering
+
+Every case runs in a forked child on a synthetic job table, so its peak
+memory can be measured on its own. Results can be saved as a baseline and
+later runs checked against it.
+"""
+
+import Queue
+import json
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+import markup
+from denovo_helper import JobTable
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(SCRIPTS_DIR, "bench_baseline.json")
+
+
+def synthetic_jobs(num_rows, seed=0):
+    """ Rows shaped like the jobs table, with some html special chars """
+    rng = random.Random(seed)
+    stats = ["queued", "submitted", "running", "finished"]
+    rows = []
+    for job_id in xrange(1, num_rows + 1):
+        chromosome = "chr{:d}".format(rng.randint(1, 22))
+        rows.append((
+            job_id,
+            rng.randint(1000, 65000),
+            "2014-07-{:02d} {:02d}:{:02d}:{:02d}.{:06d}".format(
+                rng.randint(1, 28), rng.randint(0, 23), rng.randint(0, 59),
+                rng.randint(0, 59), rng.randint(0, 999999)),
+            "denovo-{:d}".format(rng.randint(1, 50)),
+            rng.choice(stats),
+            "java -jar denovo-variant-caller-0.1.jar stage1 " +
+            "--chromosome {0} --job_name \"s1<{0}>\" ".format(chromosome) +
+            "--output_file stage1.{0}.calls 2>&1".format(chromosome),
+            rng.choice([1, 2, 4, 8])))
+    return rows
+
+
+def bench_page_construction(rows):
+    page = markup.page()
+    page.init(title="Job Table")
+    page.table(border=1)
+    for row in rows:
+        page.tr()
+        page.td(row)
+        page.tr.close()
+    page.table.close()
+    return len(page.__str__())
+
+
+def bench_addrows(rows):
+    page = markup.page()
+    page.init(title="Job Table")
+    page.table(border=1)
+    page.addrows(rows)
+    page.table.close()
+    return len(page.__str__())
+
+
+def bench_escape(rows):
+    return sum(len(markup.escape(row[5])) for row in rows)
+
+
+def bench_unescape(rows):
+    escaped = [markup.escape(row[5]) for row in rows]
+    start = time.time()
+    total = sum(len(markup.unescape(text)) for text in escaped)
+    # only the unescape pass is timed
+    return total, time.time() - start
+
+
+def bench_encode_html_rows(rows):
+    return len(JobTable.encode_html_rows(rows))
+
+
+def bench_stream_report(rows, page_size=1000):
+    tmpdir = tempfile.mkdtemp(prefix="bench-jobs-")
+    try:
+        with JobTable(os.path.join(tmpdir, "jobs.tbl")) as tbl:
+            tbl.insert_records([row[1:] for row in rows])
+            num_pages = max(1, -(-tbl.count_jobs() // page_size))
+            start = time.time()
+            size = 0
+            for page_no, page_rows in enumerate(
+                    tbl.iter_job_pages(page_size), 1):
+                size += len(JobTable.encode_html_page(page_rows, page_no,
+                                                      num_pages))
+            # loading the database is setup, only the report is timed
+            return size, time.time() - start
+    finally:
+        JobTable.close_all()
+        shutil.rmtree(tmpdir)
+
+cases = {
+    "page_construction": bench_page_construction,
+    "addrows": bench_addrows,
+    "escape": bench_escape,
+    "unescape": bench_unescape,
+    "encode_html_rows": bench_encode_html_rows,
+    "stream_report": bench_stream_report,
+}
+
+
+def _run_case(name, num_rows, queue):
+    """ Child process body: generate rows, time the case, report memory """
+    rows = synthetic_jobs(num_rows)
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    result = cases[name](rows)
+    seconds = time.time() - start
+    if isinstance(result, tuple):
+        seconds = result[1]
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before
+    queue.put({"seconds": seconds, "peak_kb": peak_kb})
+
+
+def run_case(name, num_rows):
+    """ Run one case in a fresh child process and return its measurements
+
+    Raises RuntimeError if the child dies, e.g. killed when out of memory,
+    before it reports.
+    """
+    queue = multiprocessing.Queue()
+    child = multiprocessing.Process(target=_run_case,
+                                    args=(name, num_rows, queue))
+    child.start()
+    while True:
+        try:
+            result = queue.get(timeout=1)
+            break
+        except Queue.Empty:
+            if child.exitcode is not None:
+                raise RuntimeError("{0}/{1:d} exited with code {2:d} before "
+                                   "reporting".format(name, num_rows,
+                                                      child.exitcode))
+    child.join()
+    return result
+
+
+def check(results, baseline):
+    """ Return the cases that regressed past the baseline thresholds """
+    time_threshold = baseline.get("time_threshold", 1.5)
+    memory_threshold = baseline.get("memory_threshold", 1.5)
+    regressions = []
+    for key, result in sorted(results.items()):
+        base = baseline["results"].get(key)
+        if base is None:
+            continue
+        # very short timings are mostly noise, so they get some slack
+        if result["seconds"] > max(base["seconds"], 0.05) * time_threshold:
+            regressions.append("{0}: {1:.3f}s vs baseline {2:.3f}s".format(
+                key, result["seconds"], base["seconds"]))
+        if result["peak_kb"] > max(base["peak_kb"], 1024) * memory_threshold:
+            regressions.append("{0}: {1:d}KB vs baseline {2:d}KB".format(
+                key, result["peak_kb"], base["peak_kb"]))
+    return regressions
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+    parser = ArgumentParser(description="Benchmark html rendering")
+    parser.add_argument("--sizes", type=str, default="1000,10000,100000,1000000",
+                        help="Comma separated numbers of rows")
+    parser.add_argument("--cases", type=str, default=",".join(sorted(cases)),
+                        help="Comma separated cases to run")
+    parser.add_argument("--baseline", type=str, default=DEFAULT_BASELINE,
+                        help="Baseline file to save to or check against")
+    parser.add_argument("--save", action="store_true",
+                        help="Save the results as the new baseline")
+    parser.add_argument("--check", action="store_true",
+                        help="Fail if a case regressed past the baseline")
+    parser.add_argument("--time_threshold", type=float, default=1.5,
+                        help="Allowed slowdown ratio when saving a baseline")
+    parser.add_argument("--memory_threshold", type=float, default=1.5,
+                        help="Allowed memory growth ratio when saving")
+    args = parser.parse_args()
+    if args.check and not args.save and not os.path.exists(args.baseline):
+        sys.exit("No baseline at {0}, create one with --save first".format(
+            args.baseline))
+
+    results = {}
+    for name in args.cases.split(","):
+        for num_rows in map(int, args.sizes.split(",")):
+            key = "{0}/{1:d}".format(name, num_rows)
+            results[key] = run_case(name, num_rows)
+            print("{0:<28} {seconds:9.3f}s {peak_kb:9d}KB peak".format(
+                key, **results[key]))
+
+    if args.save:
+        with open(args.baseline, "w") as fout:
+            json.dump({"time_threshold": args.time_threshold,
+                       "memory_threshold": args.memory_threshold,
+                       "python": sys.version.split()[0],
+                       "results": results}, fout, indent=2, sort_keys=True)
+        print("Saved baseline to " + args.baseline)
+
+    if args.check:
+        with open(args.baseline) as fin:
+            regressions = check(results, json.load(fin))
+        for regression in regressions:
+            print("REGRESSION " + regression)
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+#
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except
+# in compliance with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the License
+# is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+# or implied. See the License for the specific language governing permissions and limitations under
+# the License.
+
+""" Measures how long it takes before a fab task can start running
+
+Each case runs in a fresh interpreter so that import and construction
+costs are included, the same way a user pays them on every fab invocation.
+"""
+
+import json
+import os
+import subprocess
+import sys
+import time
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+FABFILE = os.path.join(SCRIPTS_DIR, "fabfile.py")
+
+cases = {
+    "import_fabfile": [sys.executable, "-c", "import fabfile"],
+    "fab_list": ["fab", "-f", FABFILE, "-l"],
+}
+
+
+def time_case(cmd, repeat):
+    """ Run cmd repeat times and return the wall times in seconds """
+    timings = []
+    with open(os.devnull, "w") as devnull:
+        for _ in xrange(repeat):
+            start = time.time()
+            subprocess.check_call(cmd, cwd=SCRIPTS_DIR, stdout=devnull)
+            timings.append(time.time() - start)
+    return timings
+
+
+def summarize(timings):
+    timings = sorted(timings)
+    return {"min": timings[0],
+            "median": timings[len(timings) // 2],
+            "max": timings[-1]}
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+    parser = ArgumentParser(description="Benchmark fabfile startup time")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="Number of runs per case")
+    parser.add_argument("--output", type=str, default=None,
+                        help="Write the results as json to this file")
+    args = parser.parse_args()
+
+    results = {}
+    for name, cmd in sorted(cases.items()):
+        results[name] = summarize(time_case(cmd, args.repeat))
+        print("{0:<16} min {min:.3f}s median {median:.3f}s max {max:.3f}s".
+              format(name, **results[name]))
+
+    if args.output is not None:
+        with open(args.output, "w") as fout:
+            json.dump(results, fout, indent=2, sort_keys=True)
@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+#
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except
+# in compliance with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the License
+# is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+# or implied. See the License for the specific language governing permissions and limitations under
+# the License.
+
+""" Compact binary index for calls files
+
+The index sits next to the calls file as <callsfile>.idx. It holds the
+calls sorted by chromosome and position in three columns, chromosome code,
+position and byte offset of the line in the calls file, and is read through
+mmap without loading it. The header records the size and mtime of the calls
+file, and a stale index is rebuilt when it is opened.
+"""
+
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+from igv_scripter import open_calls
+
+MAGIC = "DNVIDX02"
+# magic, source size, source mtime, number of calls, number of chromosomes
+HEADER = struct.Struct("<8sQdQI")
+# name length, first call, end of calls for a chromosome
+CHROMOSOME = struct.Struct("<HQQ")
+# column name, on disk format, array typecode
+COLUMNS = (("code", "<H", "H"), ("pos", "<I", "I"), ("offset", "<Q", "L"))
+
+
+def _source_stat(path):
+    st = os.stat(path)
+    return st.st_size, st.st_mtime
+
+
+def build_index(calls_path, index_path):
+    """ Scan a calls file once and write its index
+
+    Positions and offsets are kept in packed arrays per chromosome. Calls
+    files are mostly in position order already, and only the chromosomes
+    that are not get sorted, through one packed key per call.
+    """
+    for name, fmt, typecode in COLUMNS:
+        if array(typecode).itemsize != struct.calcsize(fmt):
+            raise ValueError("array('{0}') does not match {1} here".format(
+                typecode, fmt))
+    typecodes = dict((name, typecode) for (name, _, typecode) in COLUMNS)
+    chunks = {}
+    size, mtime = _source_stat(calls_path)
+    offset = 0
+    with open_calls(calls_path) as fin:
+        for line in fin:
+            fields = line.split(",", 2)
+            # comment lines are skipped as in igv_scripter.read_calls
+            if len(fields) >= 2 and not line.startswith("#"):
+                try:
+                    pos = int(fields[1])
+                except ValueError:
+                    pos = None
+                if pos is not None:
+                    chromosome = fields[0].strip()
+                    if chromosome not in chunks:
+                        chunks[chromosome] = (array(typecodes["pos"]),
+                                              array(typecodes["offset"]))
+                    chunks[chromosome][0].append(pos)
+                    chunks[chromosome][1].append(offset)
+            offset += len(line)
+
+    # order by chromosome name so that region lookups see one run each
+    names = sorted(chunks)
+    ranges, start = [], 0
+    for name in names:
+        pos_col, offset_col = chunks[name]
+        if any(pos_col[i] > pos_col[i + 1]
+               for i in xrange(len(pos_col) - 1)):
+            # pos << 32 | i sorts by position, then file order. The offset
+            # typecode is checked above to hold 64 bits.
+            keys = array(offset_col.typecode, (pos_col[i] << 32 | i
+                                               for i in xrange(len(pos_col))))
+            keys = array(offset_col.typecode, sorted(keys))
+            chunks[name] = (
+                array(pos_col.typecode, (key >> 32 for key in keys)),
+                array(offset_col.typecode,
+                      (offset_col[key & 0xffffffff] for key in keys)))
+        ranges.append((start, start + len(pos_col)))
+        start += len(pos_col)
+
+    def write_column(fout, column):
+        if sys.byteorder == "big":
+            column = array(column.typecode, column)
+            column.byteswap()
+        column.tofile(fout)
+
+    with open(index_path + ".tmp", "wb") as fout:
+        fout.write(HEADER.pack(MAGIC, size, mtime, start, len(names)))
+        for name, (first, end) in zip(names, ranges):
+            fout.write(CHROMOSOME.pack(len(name), first, end))
+            fout.write(name)
+        for code, name in enumerate(names):
+            write_column(fout, array(typecodes["code"], [code]) *
+                         len(chunks[name][0]))
+        for column in (0, 1):
+            for name in names:
+                write_column(fout, chunks[name][column])
+    os.rename(index_path + ".tmp", index_path)
+
+
+class CallsIndex(object):
+
+    """ Region queries and sampling over a memory mapped calls index """
+
+    def __init__(self, calls_path, index_path=None):
+        self.calls_path = calls_path
+        self.index_path = index_path or calls_path + ".idx"
+        if self.is_stale():
+            build_index(self.calls_path, self.index_path)
+        self._open()
+
+    def is_stale(self):
+        """ True if the index is missing or was built from another file """
+        if not os.path.exists(self.index_path):
+            return True
+        with open(self.index_path, "rb") as fin:
+            header = fin.read(HEADER.size)
+        if len(header) < HEADER.size:
+            return True
+        magic, size, mtime = HEADER.unpack(header)[:3]
+        return magic != MAGIC or (size, mtime) != _source_stat(self.calls_path)
+
+    def _open(self):
+        with open(self.index_path, "rb") as fin:
+            self.mm = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+        self.num_calls, num_chromosomes = \
+            HEADER.unpack_from(self.mm, 0)[3:]
+        self.ranges = {}
+        self.names = []
+        at = HEADER.size
+        for _ in xrange(num_chromosomes):
+            length, start, end = CHROMOSOME.unpack_from(self.mm, at)
+            at += CHROMOSOME.size
+            name = self.mm[at:at + length]
+            at += length
+            self.names.append(name)
+            self.ranges[name] = (start, end)
+        self.columns = {}
+        for name, fmt, _ in COLUMNS:
+            self.columns[name] = (at, struct.Struct(fmt))
+            at += struct.calcsize(fmt) * self.num_calls
+
+    def close(self):
+        self.mm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.num_calls
+
+    def chromosomes(self):
+        return list(self.names)
+
+    def _get(self, column, i):
+        base, item = self.columns[column]
+        return item.unpack_from(self.mm, base + i * item.size)[0]
+
+    def call(self, i):
+        """ (chromosome, pos) of the i-th call in sorted order """
+        return self.names[self._get("code", i)], self._get("pos", i)
+
+    def _lower_bound(self, lo, hi, pos):
+        """ First call in [lo, hi) at or after pos """
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._get("pos", mid) < pos:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def region_bounds(self, chromosome, start=None, end=None):
+        """ Index range of calls on chromosome with start <= pos <= end """
+        lo, hi = self.ranges.get(chromosome, (0, 0))
+        if start is not None:
+            lo = self._lower_bound(lo, hi, start)
+        if end is not None:
+            hi = self._lower_bound(lo, hi, end + 1)
+        return lo, hi
+
+    def region(self, chromosome, start=None, end=None):
+        """ Yield (chromosome, pos) for the calls in a region """
+        lo, hi = self.region_bounds(chromosome, start, end)
+        for i in xrange(lo, hi):
+            yield self.call(i)
+
+    def line(self, i):
+        """ Original line of the i-th call in the calls file
+
+        This opens the file for every call, use lines for a range.
+        """
+        with open_calls(self.calls_path) as fin:
+            fin.seek(self._get("offset", i))
+            return fin.readline().rstrip("\n")
+
+    def lines(self, lo, hi):
+        """ Yield the original lines of calls lo to hi - 1 from one handle
+
+        A region's offsets mostly increase, so on a gzipped calls file the
+        seeks mostly decompress forward rather than from the start.
+        """
+        with open_calls(self.calls_path) as fin:
+            for i in xrange(lo, hi):
+                fin.seek(self._get("offset", i))
+                yield fin.readline().rstrip("\n")
+
+    def sample(self, k, rng, chromosome=None, start=None, end=None):
+        """ k calls picked uniformly, from a region if one is given """
+        if chromosome is None:
+            lo, hi = 0, self.num_calls
+        else:
+            lo, hi = self.region_bounds(chromosome, start, end)
+        picks = rng.sample(xrange(lo, hi), min(k, hi - lo))
+        return [self.call(i) for i in picks]
+
+    def stratified_sample(self, k, rng):
+        """ k calls picked uniformly from each chromosome """
+        calls = []
+        for chromosome in self.names:
+            calls.extend(self.sample(k, rng, chromosome))
+        return calls
+
+
+def parse_region(region):
+    """ chr, chr:pos or chr:start-end to (chromosome, start, end) """
+    chromosome, _, span = region.partition(":")
+    if not span:
+        return chromosome, None, None
+    start, _, end = span.replace(",", "").partition("-")
+    return chromosome, int(start), int(end or start)
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+    parser = ArgumentParser(description="Index a calls file or query it")
+    parser.add_argument("callsfile", type=str, help="File containing calls")
+    parser.add_argument("--region", type=str, default=None,
+                        help="Print the calls in chr:start-end")
+    args = parser.parse_args()
+
+    with CallsIndex(args.callsfile) as index:
+        if args.region is None:
+            print "{0:d} calls on {1:d} chromosomes in {2}".format(
+                len(index), len(index.chromosomes()), index.index_path)
+        else:
+            for line in index.lines(
+                    *index.region_bounds(*parse_region(args.region))):
+                print line
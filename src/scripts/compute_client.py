@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+#
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except
+# in compliance with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the License
+# is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+# or implied. See the License for the specific language governing permissions and limitations under
+# the License.
+
+""" Concurrent client for the Compute API
+
+Requests for instances, disks and zone and global operations run on a pool
+of worker threads. Every worker keeps its own keep-alive connection, the
+pool size caps the requests in flight, and the access token is refreshed
+once when it expires or is rejected. The base url can point at a local
+stub server instead of GCE.
+"""
+
+import json
+import logging
+import threading
+import urllib
+from multiprocessing.pool import ThreadPool
+
+import httplib2
+from apiclient.errors import HttpError
+
+from utils import constants
+
+
+class ComputeClient(object):
+
+    """ Thread pooled REST client for one project and zone """
+
+    def __init__(self, credentials=None, base_url=None, project=None,
+                 zone=None, max_concurrency=16, timeout=60):
+        self.credentials = credentials
+        self.base_url = (base_url or constants["GCE_URL"]).rstrip("/") + "/"
+        self.project = project or constants["PROJECT_ID"]
+        self.zone = zone or constants["DEFAULT_ZONE"]
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.logger = logging.getLogger('compute_client')
+        self._local = threading.local()
+        self._token_lock = threading.Lock()
+        self._pool = None
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            self._pool = ThreadPool(self.max_concurrency)
+        return self._pool
+
+    def close(self):
+        """ Stop the worker threads """
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def _http(self):
+        """ Keep-alive connection of the calling thread """
+        if not hasattr(self._local, "http"):
+            self._local.http = httplib2.Http(timeout=self.timeout)
+        return self._local.http
+
+    def _token(self, rejected=None):
+        """ Current access token, refreshed if it expired or was rejected """
+        if self.credentials is None:
+            return None
+        with self._token_lock:
+            if self.credentials.access_token is None or \
+                    self.credentials.access_token_expired or \
+                    self.credentials.access_token == rejected:
+                self.logger.info("Refreshing access token")
+                self.credentials.refresh(httplib2.Http(timeout=self.timeout))
+            return self.credentials.access_token
+
+    def url(self, path, params=None):
+        """ Url of a path below the project, with query parameters """
+        url = self.base_url + self.project + "/" + path
+        params = dict((k, v) for (k, v) in (params or {}).items()
+                      if v is not None)
+        if params:
+            url += "?" + urllib.urlencode(sorted(params.items()))
+        return url
+
+    def request(self, method, path, body=None, params=None):
+        """ Make one request and return the decoded json response
+
+        Raises HttpError for error responses, like the discovery client.
+        """
+        url = self.url(path, params)
+        headers = {"accept": "application/json"}
+        if body is not None:
+            body = json.dumps(body)
+            headers["content-type"] = "application/json"
+        token = self._token()
+        for attempt in xrange(2):
+            if token is not None:
+                headers["authorization"] = "Bearer " + token
+            resp, content = self._http().request(url, method, body=body,
+                                                 headers=headers)
+            if resp.status == 401 and token is not None and not attempt:
+                token = self._token(rejected=token)
+                continue
+            break
+        if resp.status >= 400:
+            raise HttpError(resp, content, uri=url)
+        return json.loads(content) if content else {}
+
+    def submit(self, method, path, body=None, params=None):
+        """ Start a request on the pool, returns an AsyncResult """
+        return self.pool.apply_async(self.request,
+                                     (method, path, body, params))
+
+    @staticmethod
+    def wait_all(pending):
+        """ Results of AsyncResults in order, exceptions in place of errors """
+        results = []
+        for result in pending:
+            try:
+                results.append(result.get())
+            except Exception as e:
+                results.append(e)
+        return results
+
+    @staticmethod
+    def iter_items(list_page, **kwargs):
+        """ Items of every page of a list call, fetched as they are consumed """
+        page_token = None
+        while True:
+            response = list_page(page_token=page_token, **kwargs)
+            for item in response.get("items", []):
+                yield item
+            page_token = response.get("nextPageToken")
+            if not page_token:
+                return
+
+    def _zone_path(self, collection, name=None):
+        path = "zones/{0}/{1}".format(self.zone, collection)
+        return path if name is None else path + "/" + name
+
+    def list_instances(self, filter=None, page_token=None, fields=None,
+                       max_results=None):
+        return self.request("GET", self._zone_path("instances"), params={
+            "filter": filter, "pageToken": page_token, "fields": fields,
+            "maxResults": max_results})
+
+    def insert_instance(self, body):
+        return self.submit("POST", self._zone_path("instances"), body)
+
+    def bulk_insert_instances(self, body):
+        return self.submit("POST", self._zone_path("instances", "bulkInsert"),
+                           body)
+
+    def delete_instance(self, name):
+        return self.submit("DELETE", self._zone_path("instances", name))
+
+    def list_disks(self, filter=None, page_token=None, fields=None,
+                   max_results=None):
+        return self.request("GET", self._zone_path("disks"), params={
+            "filter": filter, "pageToken": page_token, "fields": fields,
+            "maxResults": max_results})
+
+    def insert_disk(self, body):
+        return self.submit("POST", self._zone_path("disks"), body)
+
+    def delete_disk(self, name):
+        return self.submit("DELETE", self._zone_path("disks", name))
+
+    def get_operation(self, operation):
+        """ Poll a zone or global operation """
+        if 'zone' in operation:
+            path = "zones/{0}/operations/{1}".format(
+                operation['zone'].split('/')[-1], operation['name'])
+        else:
+            path = "global/operations/" + operation['name']
+        return self.submit("GET", path)
@@ -24,6 +24,16 @@ import itertools
 from collections import defaultdict
 import markup
 import webbrowser
+import fleet
+import glob
+import planner
+import scheduler
+import time
+import tempfile
+import base64
+import zlib
+import transfer
+import ssh_session
 
 
 class DenovoHelper(object):
@@ -35,24 +45,31 @@ class DenovoHelper(object):
 
     def __init__(self, helper):
         self.gce_helper = helper
-        self.jobs = {}
-        with JobTable() as tbl:
-            for stat in ("submitted", "running"):
-                self.jobs[stat] = tbl.get_jobs_by_status(stat)
+        self._jobs = None
+
+    @property
+    def jobs(self):
+        """ Submitted and running jobs, loaded the first time they are used """
+        if self._jobs is None:
+            self._jobs = {}
+            with JobTable() as tbl:
+                for stat in ("submitted", "running"):
+                    self._jobs[stat] = tbl.get_jobs_by_status(stat)
+        return self._jobs
 
     def denovo_update_from_github(self):
         """ Update denovo-variant-caller on all hosts"""
         with cd("denovo-variant-caller"):
-            run("git pull origin master")
+            return run("git pull origin master")
 
     @with_settings(shell_escape=False)
     def denovo_any_cmd(self, cmd):
         """ Run any command on denovo instances """
-        run(cmd).splitlines()
+        return run(cmd)
 
     def single_any_cmd(self, cmd):
-        """ Run any command on denovo instances """
-        self.denovo_any_cmd(cmd)
+        """ Run any command on denovo instances over a persistent session """
+        print ssh_session.quick_run(cmd)
 
     def denovo_push_client_secrets(self):
         """ Push denovo client_secrets file to all hosts """
@@ -61,7 +78,7 @@ class DenovoHelper(object):
     def denovo_run_mvn_package(self):
         """ Run maven package on all hosts """
         with cd("denovo-variant-caller"):
-            run("mvn package")
+            return run("mvn package")
 
     @with_settings(shell_escape=False)
     def denovo_exec_bg_cmd(self,
@@ -91,47 +108,665 @@ class DenovoHelper(object):
 
     @with_settings(shell_escape=False)
     def denovo_run_from_jsonf(self, f):
-        """ Run java program from params stored in json """
-        builder = DenovoBuilder()
-        denovo_cli = builder.from_jsonf(f).to_string()
-        processid = int(self.denovo_exec_bg_cmd(denovo_cli))
-        self._table_insert_jobs(processid, denovo_cli)
-        return processid
-
-    def _table_insert_jobs(self, processid, denovo_cli):
-        """ Insert job into job table """
+        """ Run java program from params stored in json
+
+        f may also be a glob or a ;-separated list of json files. All of
+        them are started on the host and recorded in one transaction.
+        """
+        builders = [DenovoBuilder().from_jsonf(jsonf)
+                    for jsonf in DenovoHelper._expand_jsonf(f)]
+        clis = [builder.to_string() for builder in builders]
         hostname = self.gce_helper.IPtoNameMap[env.host]
+        now = datetime.datetime.now()
+        # the job ids are needed up front, they name the log files
         with JobTable() as tbl:
-            now = datetime.datetime.now()
-            max_job_id = tbl.get_max_jobid()
-            new_job_id = 1 if max_job_id is None else max_job_id+1
-            record = (
-                new_job_id,
-                processid,
-                now,
-                hostname,
-                "submitted",
-                denovo_cli)
-            tbl.insert_record(record)
+            job_ids = tbl.insert_records(
+                [(None, now, hostname, "starting", cli, builder.threads())
+                 for (cli, builder) in zip(clis, builders)])
+        launched = {}
+        try:
+            self._launch_on_host(dict(zip(job_ids, clis)), launched)
+        finally:
+            # record the jobs that did start even if the launch is cut short
+            with JobTable() as tbl:
+                tbl.update_records(DenovoHelper._launch_updates(
+                    hostname, job_ids, launched, {"stat": "failed"}))
+        return [launched[job_id] for job_id in job_ids if job_id in launched]
+
+    @staticmethod
+    def job_log_paths(job_id):
+        """ Remote (stdout, stderr) log files of a job """
+        log_dir = utils.constants["REMOTE_LOG_DIR"]
+        return (os.path.join(log_dir, "job-{:d}.out".format(job_id)),
+                os.path.join(log_dir, "job-{:d}.err".format(job_id)))
+
+    def _launch_on_host(self, clis, launched=None):
+        """ Start jobs on the current host, each with its own log files
+
+        clis maps job id to command line. Returns a map of job id to pid
+        for the jobs that started. If launched is given it is filled in as
+        jobs start, so the caller keeps their pids if this is cut short.
+        """
+        if launched is None:
+            launched = {}
+        run("mkdir -p " + utils.constants["REMOTE_LOG_DIR"])
+        with settings(shell_escape=False):
+            for job_id in sorted(clis):
+                out, err = DenovoHelper.job_log_paths(job_id)
+                try:
+                    launched[job_id] = int(self.denovo_exec_bg_cmd(
+                        clis[job_id], err=err, out=out))
+                # outside the fleet executor abort raises SystemExit
+                except (Exception, SystemExit) as e:
+                    print "Could not start job {:d}: {}".format(job_id, e)
+        return launched
+
+    @staticmethod
+    def _launch_updates(hostname, job_ids, launched, failed_update):
+        """ Job table updates for an attempt to start job_ids on a host """
+        now = datetime.datetime.now()
+        updates = {}
+        for job_id in job_ids:
+            if job_id in launched:
+                updates[job_id] = {"pid": launched[job_id], "ts": now,
+                                   "mach": hostname, "stat": "submitted"}
+            elif failed_update is not None:
+                updates[job_id] = failed_update
+        return updates
+
+    def _launch_jobs(self, jobs_by_ip, clis, pool_size, failed_update):
+        """ Start jobs that are in the job table, in parallel over hosts
+
+        jobs_by_ip maps host ip to job ids and clis maps job id to command
+        line. The outcome is recorded in one transaction, with
+        failed_update applied to jobs that did not start. Returns the
+        number of started jobs. If the run is interrupted, jobs of hosts
+        without a result are left as they are, since they may have started.
+        """
+        def launch():
+            # keep the pids of the jobs that started if the host fails later
+            launched = {}
+            try:
+                self._launch_on_host(dict((job_id, clis[job_id]) for job_id
+                                          in jobs_by_ip[env.host]), launched)
+            except Exception as e:
+                print "Launch on {0} cut short: {1}".format(env.host, e)
+            return launched
+
+        results = {}
+        try:
+            results = fleet.run_parallel(launch, jobs_by_ip.keys(),
+                                         int(pool_size))
+            fleet.print_results(results, self.gce_helper.IPtoNameMap)
+        finally:
+            updates = {}
+            for ip, job_ids in jobs_by_ip.items():
+                result = results.get(ip)
+                if result is None:
+                    continue
+                launched = result.output if result.succeeded else {}
+                updates.update(DenovoHelper._launch_updates(
+                    self.gce_helper.IPtoNameMap[ip], job_ids, launched,
+                    failed_update))
+            with JobTable() as tbl:
+                tbl.update_records(updates)
+        return sum(1 for update in updates.values()
+                   if update.get("stat") == "submitted")
+
+    @staticmethod
+    def _expand_jsonf(f):
+        """ Expand a ;-separated list of json files and globs """
+        jsonfs = []
+        for pattern in f.split(";"):
+            matches = sorted(glob.glob(os.path.expanduser(pattern)))
+            if not matches:
+                raise IOError("No json file matches " + pattern)
+            jsonfs.extend(matches)
+        return jsonfs
 
     def denovo_table_update_jobs(self):
         """ Update the jobs table """
+        updates = self._host_status_updates()
+        with JobTable() as tbl:
+            tbl.update_stats(updates)
+
+    def _host_status_updates(self):
+        """ Probe the current host and return its job status changes """
         hostname = self.gce_helper.IPtoNameMap[env.host]
-        updates = defaultdict(list)
+        host_jobs = [job for job in
+                     itertools.chain(self.jobs["submitted"],
+                                     self.jobs["running"])
+                     if job[3] == hostname]
+
+        probe = self._probe_pids([job[1] for job in host_jobs])
+        updates = {}
+        for job in host_jobs:
+            job_id, pid, stat = job[0], job[1], job[4]
+            proc = probe[pid]
+            new_stat = "running" if proc["alive"] else "finished"
+            if new_stat != stat:
+                updates[job_id] = new_stat
+            if proc["alive"]:
+                print "job {:d} pid {:d}: elapsed {:d}s cpu {:d}s rss {:d}KB".\
+                    format(job_id, pid, proc["etime"], proc["cputime"],
+                           proc["rss"])
+        return updates
+
+    def fleet_update_from_github(self, pool_size=10, timeout=600):
+        """ Update denovo-variant-caller on all hosts in parallel """
+        self._fleet_run(self.denovo_update_from_github, pool_size, timeout)
+
+    def fleet_run_mvn_package(self, pool_size=10, timeout=1800):
+        """ Run maven package on all hosts in parallel """
+        self._fleet_run(self.denovo_run_mvn_package, pool_size, timeout)
+
+    def fleet_any_cmd(self, cmd, pool_size=10, timeout=600):
+        """ Run any command on all hosts in parallel and show the output """
+        results = self._fleet_run(self.denovo_any_cmd, pool_size, timeout,
+                                  cmd)
+        for host, result in sorted(results.items()):
+            if result.succeeded:
+                print "[{0}]".format(self.gce_helper.IPtoNameMap[host])
+                print result.output
+
+    def fleet_table_update_jobs(self, pool_size=10, timeout=120):
+        """ Probe all hosts in parallel and update the jobs table once
+
+        Jobs still starting without a pid after STARTING_TIMEOUT seconds
+        were left behind by a launch that died, they are marked failed.
+        """
+        # load the jobs before forking so every worker sees them
+        self.jobs
+        results = self._fleet_run(self._host_status_updates, pool_size,
+                                  timeout)
+        updates = {}
+        for result in results.values():
+            if result.succeeded:
+                updates.update(result.output)
+        cutoff = str(datetime.datetime.now() - datetime.timedelta(
+            seconds=utils.constants["STARTING_TIMEOUT"]))
+        with JobTable() as tbl:
+            for job in tbl.get_jobs_by_status("starting"):
+                if job[1] is None and job[2] < cutoff:
+                    updates[job[0]] = "failed"
+            tbl.update_stats(updates)
+
+    def fleet_teardown(self, max_parallel=20):
+        """ Delete all denovo instances and orphaned disks concurrently
+
+        Jobs that were still starting, submitted or running on the deleted
+        instances are cancelled in one transaction at the end.
+
+        Keyword arguments:
+        max_parallel -- max delete operations in flight (default 20)
+        """
+        if not utils.confirm():
+            return
+        deleted = set(self.gce_helper._teardown_denovo_instances(
+            int(max_parallel)))
+        with JobTable() as tbl:
+            updates = dict((job[0], "cancelled")
+                           for stat in ("starting", "submitted", "running")
+                           for job in tbl.get_jobs_by_status(stat)
+                           if job[3] in deleted)
+            tbl.update_stats(updates)
+        print "Cancelled {:d} jobs".format(len(updates))
+
+    def fleet_ssh_status(self):
+        """ Show which hosts have a live persistent ssh session """
+        hosts = set(ssh_session.open_hosts()) | set(
+            ip for (name, ip) in self.gce_helper.nameToIPMap.items()
+            if 'denovo' in name)
+        for ip in sorted(hosts):
+            print "{0:<20} {1:<16} {2}".format(
+                self.gce_helper.IPtoNameMap.get(ip, "?"), ip,
+                "open" if ssh_session.check(ip) else "closed")
+
+    def fleet_ssh_close(self):
+        """ Close all persistent ssh sessions """
+        closed = [ip for ip in ssh_session.open_hosts()
+                  if ssh_session.close(ip)]
+        print "Closed {:d} ssh sessions".format(len(closed))
+
+    def fleet_collect_logs(self, pool_size=10, stat=None):
+        """ Fetch new log output of jobs from all hosts in parallel
+
+        Only the bytes written since the last collection are transferred,
+        gzipped. The local copies in LOCAL_LOG_DIR double as the offsets.
+
+        Keyword arguments:
+        pool_size -- number of hosts read at once (default 10)
+        stat -- only jobs with this status (default submitted and running)
+        """
+        stats = ["submitted", "running"] if stat is None else [stat]
+        with JobTable() as tbl:
+            jobs = [job for status in stats
+                    for job in tbl.get_jobs_by_status(status) if job[3]]
+
+        wanted_by_ip = {}
+        for job in jobs:
+            ip = self.gce_helper.nameToIPMap.get(job[3])
+            if ip is None:
+                continue
+            for path in DenovoHelper.job_log_paths(job[0]):
+                name = os.path.basename(path)
+                wanted_by_ip.setdefault(ip, []).append(
+                    (name, DenovoHelper._local_log_size(name)))
 
-        for job in itertools.chain(self.jobs["submitted"], self.jobs["running"]):
-            db_hostname, db_pid = job[3], job[1]
-            if db_hostname != hostname:
+        def fetch():
+            with hide('output'):
+                output = run(DenovoHelper._log_tail_cmd(
+                    wanted_by_ip[env.host]))
+            return [line.split() for line in output.splitlines()
+                    if line.strip()]
+
+        results = fleet.run_parallel(fetch, wanted_by_ip.keys(),
+                                     int(pool_size))
+        fleet.print_results(results, self.gce_helper.IPtoNameMap)
+
+        total = 0
+        for result in results.values():
+            if not result.succeeded:
+                continue
+            for fields in result.output:
+                if len(fields) != 4:
+                    continue
+                name, start, data = fields[0], int(fields[1]), fields[3]
+                chunk = zlib.decompress(base64.b64decode(data),
+                                        16 + zlib.MAX_WBITS)
+                # start is 0 again when the remote log was truncated
+                mode = "ab" if start else "wb"
+                with open(DenovoHelper._local_log_path(name), mode) as fout:
+                    fout.write(chunk)
+                total += len(chunk)
+        print "Collected {:d} new bytes of {:d} jobs' logs".format(
+            total, len(jobs))
+
+    def fleet_collect_outputs(self, dest=None, pool_size=10):
+        """ Fetch the output files of finished jobs from all hosts
+
+        Each host sends its files over one compressed rsync stream. Partial
+        transfers resume, every file is checked against the remote sha256,
+        and files verified by an earlier run are skipped.
+
+        Keyword arguments:
+        dest -- local directory, one subdirectory per host
+                (default LOCAL_OUTPUT_DIR)
+        pool_size -- number of hosts fetched from at once (default 10)
+        """
+        dest = utils.constants["LOCAL_OUTPUT_DIR"] if dest is None else \
+            os.path.expanduser(dest)
+        manifest = transfer.Manifest(os.path.join(dest, "manifest.json"))
+        with JobTable() as tbl:
+            finished = tbl.get_jobs_by_status("finished")
+
+        wanted_by_ip, skipped = {}, 0
+        for job in finished:
+            builder = DenovoHelper._parse_job_cmd(job[0], job[5])
+            if builder is None:
+                continue
+            output_file = builder.opts.get("output_file")
+            ip = self.gce_helper.nameToIPMap.get(job[3])
+            if output_file is None or ip is None:
+                continue
+            local_path = os.path.join(dest, job[3], output_file.lstrip("/"))
+            if manifest.has(job[3] + "/" + output_file, local_path):
+                skipped += 1
+                continue
+            wanted_by_ip.setdefault(ip, set()).add(output_file)
+
+        def fetch():
+            return transfer.fetch_verified(
+                sorted(wanted_by_ip[env.host]),
+                os.path.join(dest, self.gce_helper.IPtoNameMap[env.host]))
+
+        results = fleet.run_parallel(fetch, wanted_by_ip.keys(),
+                                     int(pool_size))
+        fleet.print_results(results, self.gce_helper.IPtoNameMap)
+
+        fetched = 0
+        for ip, result in results.items():
+            if not result.succeeded:
+                continue
+            hostname = self.gce_helper.IPtoNameMap[ip]
+            for output_file, checksum in result.output.items():
+                manifest.entries[hostname + "/" + output_file] = checksum
+                fetched += 1
+        manifest.save()
+        wanted = sum(len(files) for files in wanted_by_ip.values())
+        print "Fetched {:d} of {:d} outputs, {:d} already present, in {}".\
+            format(fetched, wanted, skipped, dest)
+
+    def table_tail_log(self, jobid, stream="out", lines=20):
+        """ Show the end of a job's collected log (stream out or err) """
+        path = DenovoHelper._local_log_path("job-{:d}.{}".format(
+            int(jobid), stream))
+        if not os.path.exists(path):
+            print "No log collected for job {0} yet".format(jobid)
+            return
+        with open(path) as fin:
+            for line in fin.readlines()[-int(lines):]:
+                print line.rstrip("\n")
+
+    @staticmethod
+    def _local_log_path(name):
+        """ Local copy of a remote log file """
+        log_dir = utils.constants["LOCAL_LOG_DIR"]
+        if not os.path.exists(log_dir):
+            os.makedirs(log_dir)
+        return os.path.join(log_dir, name)
+
+    @staticmethod
+    def _local_log_size(name):
+        """ Bytes of a log collected so far, the offset to read on from """
+        path = DenovoHelper._local_log_path(name)
+        return os.path.getsize(path) if os.path.exists(path) else 0
+
+    @staticmethod
+    def _log_tail_cmd(wanted):
+        """ Shell command that prints what was added to logs since offsets
+
+        wanted is a list of (log name, offset). For each log that grew the
+        command prints a line "name offset size data", with data the new
+        bytes gzipped and base64 encoded.
+        """
+        specs = " ".join("{0}:{1:d}".format(name, offset)
+                         for (name, offset) in wanted)
+        return ("cd {0} 2>/dev/null || exit 0; "
+                "for spec in {1}; do "
+                "f=${{spec%:*}}; n=${{spec##*:}}; "
+                "[ -f $f ] || continue; "
+                "s=$(stat -c %s $f); "
+                "[ $s -lt $n ] && n=0; "
+                "[ $s -eq $n ] && continue; "
+                "echo $f $n $s "
+                "$(tail -c +$((n+1)) $f | head -c $((s-n)) | gzip -c "
+                "| base64 -w0); "
+                "done").format(utils.constants["REMOTE_LOG_DIR"], specs)
+
+    def fleet_sample_jobs(self, pool_size=10, interval=60, count=1):
+        """ Record cpu, memory and io of running jobs from /proc
+
+        Every host is sampled with one remote command per round, and each
+        round is stored in one transaction.
+
+        Keyword arguments:
+        pool_size -- number of hosts sampled at once (default 10)
+        interval -- seconds between rounds (default 60)
+        count -- number of rounds (default 1)
+        """
+        with JobTable() as tbl:
+            jobs = [job for status in ("submitted", "running")
+                    for job in tbl.get_jobs_by_status(status) if job[1]]
+
+        pids_by_ip, job_ids = {}, {}
+        for job in jobs:
+            ip = self.gce_helper.nameToIPMap.get(job[3])
+            if ip is None:
                 continue
-            if not self._check_pid_exists(db_pid):
-                updates["finished"].append(job[0])
-            else:
-                updates["running"].append(job[0])
+            pids_by_ip.setdefault(ip, []).append(job[1])
+            job_ids[(ip, job[1])] = job[0]
+
+        def sample():
+            with hide('output'):
+                output = run(DenovoHelper._proc_sample_cmd(
+                    pids_by_ip[env.host]))
+            return DenovoHelper._parse_proc_samples(output)
+
+        for round_no in xrange(int(count)):
+            if round_no:
+                time.sleep(float(interval))
+            results = fleet.run_parallel(sample, pids_by_ip.keys(),
+                                         int(pool_size))
+            fleet.print_results(results, self.gce_helper.IPtoNameMap)
+            now = datetime.datetime.now()
+            samples = []
+            for ip, result in results.items():
+                if not result.succeeded:
+                    continue
+                for pid, usage in result.output.items():
+                    samples.append((job_ids[(ip, pid)], now) + tuple(
+                        usage[name] for name in JobTable.sample_columns[2:]))
+            with JobTable() as tbl:
+                tbl.insert_samples(samples)
+            print "Recorded samples of {:d} of {:d} jobs".format(
+                len(samples), len(job_ids))
 
-        updates = dict(updates)
+    def table_usage_summary(self):
+        """ Peak rss, mean cpu use and wall time by chromosome and params """
         with JobTable() as tbl:
-            for stat in updates:
-                tbl.update_stat(updates[stat], stat)
+            usage = tbl.get_job_usage()
+        print "{0:<8} {1:>4} {2:>12} {3:>9} {4:>10} {5:>10}  {6}".format(
+            "chrom", "jobs", "peak rss MB", "cpu/core", "mean wall",
+            "max wall", "params")
+        for (chromosome, params), summary in sorted(
+                DenovoHelper._summarize_usage(usage).items()):
+            print "{0:<8} {jobs:>4d} {peak_rss_mb:>12.1f} " \
+                "{cpu_utilisation:>9.2f} {mean_wall:>9.0f}s " \
+                "{max_wall:>9.0f}s  {1}".format(chromosome, params, **summary)
+
+    @staticmethod
+    def _parse_job_cmd(job_id, cmd):
+        """ DenovoBuilder of a job's command, None if it does not parse """
+        try:
+            # argparse exits on arguments it does not know
+            return DenovoBuilder().from_string(cmd or "")
+        except (SystemExit, ValueError):
+            print "Skipping job {0}, unknown command: {1}".format(job_id, cmd)
+            return None
+
+    @staticmethod
+    def _summarize_usage(usage):
+        """ Group get_job_usage rows by chromosome and parameter set
+
+        cpu_utilisation is cpu time over wall time and threads, averaged
+        over the jobs that have a wall time, so 1.0 means every thread was
+        kept busy. Jobs from before the threads column take their threads
+        from the command.
+        """
+        groups = defaultdict(list)
+        for job_id, cmd, threads, peak_rss_kb, etime, cpu_seconds in usage:
+            builder = DenovoHelper._parse_job_cmd(job_id, cmd)
+            if builder is None:
+                continue
+            groups[(builder.opts.get("chromosome") or "all",
+                    builder.param_set())].append(
+                (threads or builder.threads(), peak_rss_kb or 0, etime or 0,
+                 cpu_seconds or 0))
+        summary = {}
+        for key, jobs in groups.items():
+            timed = [(threads, etime, cpu) for (threads, _, etime, cpu)
+                     in jobs if etime]
+            summary[key] = {
+                "jobs": len(jobs),
+                "peak_rss_mb": max(rss for (_, rss, _, _) in jobs) / 1024.0,
+                "cpu_utilisation": sum(
+                    float(cpu) / etime / threads
+                    for (threads, etime, cpu) in timed) / max(len(timed), 1),
+                "mean_wall": sum(etime for (_, etime, _) in timed) /
+                float(max(len(timed), 1)),
+                "max_wall": max(etime for (_, _, etime, _) in jobs)}
+        return summary
+
+    @staticmethod
+    def _proc_sample_cmd(pids):
+        """ Shell command that prints /proc usage of many pids at once
+
+        The first line is "clk <ticks per second> <uptime>". Then every live
+        pid gets a "pid <pid>" line, its stat fields after the command name,
+        and the VmRSS, VmHWM, read_bytes and write_bytes lines.
+        """
+        return ("echo clk $(getconf CLK_TCK) $(cut -d' ' -f1 /proc/uptime); "
+                "for p in {0}; do "
+                "[ -r /proc/$p/stat ] || continue; "
+                "echo pid $p; "
+                "sed 's/.*) //' /proc/$p/stat; "
+                "grep -E '^(VmRSS|VmHWM):' /proc/$p/status; "
+                "grep -E '^(read_bytes|write_bytes):' /proc/$p/io "
+                "2>/dev/null; "
+                "done").format(" ".join(str(pid) for pid in pids))
+
+    @staticmethod
+    def _parse_proc_samples(output):
+        """ Parse _proc_sample_cmd output into a map of pid to usage """
+        clk, uptime, pid, raw = 100.0, 0.0, None, {}
+        for line in output.splitlines():
+            fields = line.split()
+            if len(fields) < 2:
+                continue
+            if fields[0] == "clk" and len(fields) == 3:
+                clk, uptime = float(fields[1]), float(fields[2])
+            elif fields[0] == "pid":
+                pid = int(fields[1])
+                raw[pid] = {}
+            elif pid is None:
+                continue
+            elif fields[0].endswith(":"):
+                raw[pid][fields[0][:-1]] = int(fields[1])
+            elif len(fields) > 19:
+                # utime, stime and starttime are fields 14, 15 and 22 of
+                # /proc/<pid>/stat, counted from the pid
+                raw[pid]["cpu_seconds"] = (int(fields[11]) +
+                                           int(fields[12])) / clk
+                raw[pid]["etime"] = uptime - int(fields[19]) / clk
+        return dict((pid, {"etime": usage["etime"],
+                           "cpu_seconds": usage["cpu_seconds"],
+                           "rss_kb": usage.get("VmRSS"),
+                           "peak_rss_kb": usage.get("VmHWM"),
+                           "read_bytes": usage.get("read_bytes"),
+                           "write_bytes": usage.get("write_bytes")})
+                    for (pid, usage) in raw.items() if "etime" in usage)
+
+    def fleet_submit_plan(self, f, region_size=None, lengths=None,
+                          pool_size=10, dry_run=False, queue=False):
+        """ Shard a whole-genome json spec and start it across all hosts
+
+        Keyword arguments:
+        region_size -- bases per shard (default one shard per chromosome)
+        lengths -- file of chromosome lengths (default hg19)
+        pool_size -- number of hosts started at once (default 10)
+        dry_run -- only print the plan (default False)
+        queue -- queue the shards, largest first, for fleet_schedule instead
+                 of starting them now (default False)
+        """
+        spec = DenovoBuilder().from_jsonf(f)
+        job_planner = planner.JobPlanner(
+            spec.opts, None if lengths is None else
+            planner.load_lengths(lengths))
+        if utils.str_to_bool(queue):
+            shards = sorted(job_planner.shards(region_size),
+                            key=lambda shard: -shard.cost)
+            clis = [DenovoBuilder().update_from_dict(
+                job_planner.shard_opts(shard)).to_string()
+                for shard in shards]
+            if not utils.str_to_bool(dry_run):
+                self._table_enqueue(clis, [spec.threads()] * len(clis))
+            print "Queued {:d} shards".format(len(clis))
+            return
+
+        host_cores = self.gce_helper._denovo_host_cores()
+        plan = planner.JobPlanner.pack(job_planner.shards(region_size),
+                                       host_cores)
+        planner.JobPlanner.describe(plan, host_cores)
+        if utils.str_to_bool(dry_run):
+            return plan
+
+        now = datetime.datetime.now()
+        hosts, ips, clis = [], [], []
+        for host, shards in plan.items():
+            for shard in shards:
+                hosts.append(host)
+                ips.append(self.gce_helper.nameToIPMap[host])
+                clis.append(DenovoBuilder().update_from_dict(
+                    job_planner.shard_opts(shard)).to_string())
+        with JobTable() as tbl:
+            job_ids = tbl.insert_records(
+                [(None, now, host, "starting", cli, spec.threads())
+                 for (host, cli) in zip(hosts, clis)])
+
+        # every shard is recorded on its own, a failing launch on a host
+        # fails only the shards that did not start there
+        jobs_by_ip = {}
+        for ip, job_id in zip(ips, job_ids):
+            jobs_by_ip.setdefault(ip, []).append(job_id)
+        self._launch_jobs(jobs_by_ip, dict(zip(job_ids, clis)), pool_size,
+                          {"stat": "failed"})
+        return plan
+
+    def table_enqueue_jsonf(self, f):
+        """ Queue jobs from json specs for fleet_schedule to start """
+        builders = [DenovoBuilder().from_jsonf(jsonf)
+                    for jsonf in DenovoHelper._expand_jsonf(f)]
+        job_ids = self._table_enqueue(
+            [builder.to_string() for builder in builders],
+            [builder.threads() for builder in builders])
+        print "Queued jobs : {0}".format(" ".join(map(str, job_ids)))
+
+    def _table_enqueue(self, clis, threads):
+        """ Insert queued jobs, with no host or pid yet """
+        now = datetime.datetime.now()
+        records = [(None, now, None, "queued", cli, num_threads)
+                   for (cli, num_threads) in zip(clis, threads)]
+        with JobTable() as tbl:
+            return tbl.insert_records(records)
+
+    def fleet_schedule(self, pool_size=10, interval=0):
+        """ Start queued jobs on hosts with free cores
+
+        Keyword arguments:
+        pool_size -- number of hosts worked on at once (default 10)
+        interval -- if set, keep scheduling every interval seconds until
+                    the queue is empty (default 0, schedule once)
+        """
+        interval = float(interval)
+        while True:
+            self._jobs = None
+            self.fleet_table_update_jobs(pool_size)
+            queued = self._schedule_once(pool_size)
+            if not interval or not queued:
+                break
+            print "{:d} jobs still queued, next round in {:.0f}s".format(
+                queued, interval)
+            time.sleep(interval)
+
+    def _schedule_once(self, pool_size):
+        """ Dispatch queued jobs once, return how many remain queued """
+        host_cores = self.gce_helper._denovo_host_cores()
+        with JobTable() as tbl:
+            queued = tbl.get_queued_jobs()
+            used_slots = tbl.get_used_slots(
+                max(host_cores.values()) if host_cores else None)
+        slots = scheduler.SlotScheduler(host_cores, used_slots)
+        assignment = slots.assign((job[0], job[6]) for job in queued)
+
+        clis = dict((job[0], job[5]) for job in queued)
+        # claim the jobs first, so that another scheduler, or this one after
+        # an interruption, does not start them a second time
+        with JobTable() as tbl:
+            claimed = tbl.claim_jobs(assignment)
+        taken = sum(len(job_ids) for job_ids in assignment.values()) - \
+            sum(len(job_ids) for job_ids in claimed.values())
+        jobs_by_ip = dict((self.gce_helper.nameToIPMap[host], job_ids)
+                          for (host, job_ids) in claimed.items())
+        # jobs that could not be started go back to the queue
+        started = self._launch_jobs(jobs_by_ip, clis, pool_size,
+                                    {"stat": "queued", "mach": None})
+
+        remaining = len(queued) - started - taken
+        print "Started {:d} jobs, {:d} queued, free slots: {}".format(
+            started, remaining,
+            ", ".join("{0}={1:d}".format(host, free) for (host, free)
+                      in sorted(slots.free_slots().items())))
+        return remaining
+
+    def _fleet_run(self, func, pool_size, timeout, *args):
+        """ Run func on every denovo host in parallel and print a summary """
+        hosts = [ip for (name, ip) in self.gce_helper.nameToIPMap.items()
+                 if 'denovo' in name]
+        results = fleet.run_parallel(func, hosts, int(pool_size),
+                                     float(timeout), *args)
+        fleet.print_results(results, self.gce_helper.IPtoNameMap)
+        return results
 
     def table_display_all(self):
         """ Display all table results """
@@ -145,6 +780,43 @@ class DenovoHelper(object):
         webbrowser.open(outf, new=2)
 
 
+    def table_report(self, stat=None, mach=None, since=None, until=None,
+                     sort="ts", order="desc", page_size=1000, outdir=None):
+        """ Write matching jobs as paginated html and open the first page
+
+        Rows are streamed from the database one page at a time.
+
+        Keyword arguments:
+        stat -- only jobs with this status
+        mach -- only jobs on this host
+        since, until -- only jobs started in [since, until), e.g. 2014-07-01
+        sort -- column to sort by (default ts)
+        order -- asc or desc (default desc)
+        page_size -- rows per page (default 1000)
+        outdir -- directory for the pages (default a new temporary one)
+        """
+        page_size = int(page_size)
+        order = order.lower()
+        if order not in ("asc", "desc"):
+            raise ValueError("order should be asc or desc, not " + order)
+        if outdir is None:
+            outdir = tempfile.mkdtemp(prefix="jobs-")
+        filters = dict(stat=stat, mach=mach, since=since, until=until)
+        with JobTable() as tbl:
+            num_pages = max(1, -(-tbl.count_jobs(**filters) // page_size))
+            pages = tbl.iter_job_pages(page_size, sort=sort,
+                                       descending=order == "desc", **filters)
+            for page_no in xrange(1, num_pages + 1):
+                rows = next(pages, [])
+                html = JobTable.encode_html_page(rows, page_no, num_pages)
+                with open(os.path.join(outdir, JobTable.page_name(page_no)),
+                          'w') as fout:
+                    fout.write(html)
+
+        first_page = os.path.join(outdir, JobTable.page_name(1))
+        print "Wrote {:d} pages to {}".format(num_pages, outdir)
+        webbrowser.open(first_page, new=2)
+
     def table_kill_all_jobs(self):
         """ Kill all running jobs """
         with JobTable() as tbl:
@@ -159,14 +831,56 @@ class DenovoHelper(object):
         print "Killing job : {:d}".format(jobid)
         with JobTable() as tbl:
             job_record = tbl.get_job_by_jobid(jobid)
+            # a starting job without a pid has no process to kill yet
+            if job_record[4] == "queued" or (job_record[4] == "starting" and
+                                            job_record[1] is None):
+                tbl.update_stats({jobid: "cancelled"})
+                return
         pid, hostname = job_record[1], job_record[3]
+        if pid is None:
+            print "Job {0:d} is {1} and has no process".format(
+                jobid, job_record[4])
+            return
         ip = self.gce_helper.nameToIPMap[hostname]
-        with settings(host_string=ip):
-            self.denovo_any_cmd("kill -9 {:d}".format(pid))
+        ssh_session.mux_run(ip, "kill -9 {:d}".format(pid))
 
     def _check_pid_exists(self, pid):
         """ Check that a pid exists """
-        return int(run("[ -e /proc/%d ] && echo 1 || echo 0" % pid))
+        return int(ssh_session.quick_run(
+            "[ -e /proc/%d ] && echo 1 || echo 0" % pid))
+
+    def _probe_pids(self, pids):
+        """ Check many pids on the current host with one remote command
+
+        Returns a map of pid to a dict with "alive" and, for live pids,
+        "etime" and "cputime" in seconds and "rss" in KB.
+        """
+        probe = dict((pid, {"alive": False}) for pid in pids)
+        if not probe:
+            return probe
+
+        # ps exits non-zero when some of the pids are gone
+        cmd = "ps -o pid=,etime=,time=,rss= -p %s || true" % \
+            ",".join(str(pid) for pid in probe)
+        for line in ssh_session.quick_run(cmd).splitlines():
+            fields = line.split()
+            if len(fields) != 4 or not fields[0].isdigit():
+                continue
+            probe[int(fields[0])] = {
+                "alive": True,
+                "etime": DenovoHelper._parse_ps_time(fields[1]),
+                "cputime": DenovoHelper._parse_ps_time(fields[2]),
+                "rss": int(fields[3])}
+        return probe
+
+    @staticmethod
+    def _parse_ps_time(value):
+        """ Convert a ps time of the form [[dd-]hh:]mm:ss to seconds """
+        days, _, clock = value.rpartition("-")
+        seconds = 0
+        for part in clock.split(":"):
+            seconds = seconds * 60 + int(part)
+        return seconds + int(days or 0) * 86400
 
 
 class DenovoBuilder(object):
@@ -175,9 +889,12 @@ class DenovoBuilder(object):
 
     arglist = ["stage_id"]
     optlist = ["chromosome", "client_secrets_filename", "debug_level",
-               "denovo_mut_rate", "inference_method", "input_file",
-               "job_name", "lrt_threshold", "num_threads", "output_file",
-               "seq_err_rate"]
+               "denovo_mut_rate", "end_position", "inference_method",
+               "input_file", "job_name", "lrt_threshold", "num_threads",
+               "output_file", "seq_err_rate", "start_position"]
+    # options that differ between the shards of one run
+    shard_opts = ["chromosome", "client_secrets_filename", "end_position",
+                  "input_file", "job_name", "output_file", "start_position"]
     java_string = "java -jar denovo-variant-caller/target/denovo-variant-caller-0.1.jar "
 
     def __init__(self):
@@ -222,39 +939,239 @@ class DenovoBuilder(object):
 
     def update_from_dict(self, d):
         self.opts.update(d)
+        return self
+
+    def threads(self):
+        """ Number of threads the job will use """
+        return int(self.opts.get("num_threads") or 1)
+
+    def param_set(self):
+        """ Options that are not specific to one shard, as a string """
+        return " ".join("{0}={1}".format(k, v)
+                        for (k, v) in sorted(self.opts.items())
+                        if v is not None and k not in DenovoBuilder.shard_opts)
 
 
 class JobTable:
 
     """ MySQL table containing all the jobs and the job ids """
-    columns = ["job_id", "pid", "ts", "mach", "stat", "cmd"]
+    columns = ["job_id", "pid", "ts", "mach", "stat", "cmd", "threads"]
+
+    # Schema migrations, applied in order. The schema version is kept in
+    # sqlite's user_version, so version N means migrations[:N] were applied.
+    migrations = [
+        # 1: autoincrementing primary key and indexes. Job ids that were
+        # handed out twice by the old max(job_id)+1 scheme get fresh ids.
+        ["create table if not exists jobs(job_id int, pid int, " +
+         "ts timestamp, mach text, stat text, cmd text)",
+         "alter table jobs rename to jobs_v0",
+         "create table jobs(job_id integer primary key autoincrement, " +
+         "pid int, ts timestamp, mach text, stat text, cmd text)",
+         "insert into jobs(job_id, pid, ts, mach, stat, cmd) " +
+         "select job_id, pid, ts, mach, stat, cmd from jobs_v0 " +
+         "where rowid in (select min(rowid) from jobs_v0 " +
+         "where job_id is not null group by job_id)",
+         "insert into jobs(pid, ts, mach, stat, cmd) " +
+         "select pid, ts, mach, stat, cmd from jobs_v0 " +
+         "where rowid not in (select min(rowid) from jobs_v0 " +
+         "where job_id is not null group by job_id) order by rowid",
+         "drop table jobs_v0",
+         "create index jobs_stat on jobs(stat)",
+         "create index jobs_mach on jobs(mach)",
+         "create index jobs_ts on jobs(ts)"],
+        # 2: cores taken by each job, for the slot scheduler
+        ["alter table jobs add column threads int"],
+        # 3: resource samples of running jobs, see fleet_sample_jobs
+        ["create table job_samples(" +
+         "job_id integer not null references jobs(job_id), " +
+         "ts timestamp, etime real, cpu_seconds real, rss_kb int, " +
+         "peak_rss_kb int, read_bytes int, write_bytes int)",
+         "create index job_samples_job_id on job_samples(job_id, ts)"],
+    ]
+    sample_columns = ["job_id", "ts", "etime", "cpu_seconds", "rss_kb",
+                      "peak_rss_kb", "read_bytes", "write_bytes"]
+
+    # (path, process id) -> connection. Connections stay open for the life
+    # of the process, and are never shared with forked fabric workers.
+    _connections = {}
+
+    def __init__(self, path=None):
+        self.path = utils.constants["JOB_TABLE"] if path is None else path
 
     def __enter__(self):
-        self.con = lite.connect(utils.constants["JOB_TABLE"])
+        key = (self.path, os.getpid())
+        if key in JobTable._connections:
+            self.con = JobTable._connections[key]
+            self.cur = self.con.cursor()
+            return self
+
+        self.con = lite.connect(self.path, timeout=30)
         self.cur = self.con.cursor()
-        self._create_table()
+        # WAL lets readers carry on while another fab process writes
+        self.cur.execute("pragma journal_mode=wal")
+        self._migrate_schema()
+        JobTable._connections[key] = self.con
         return self
 
     def __exit__(self, type, value, traceback):
-        self.con.close()
+        if type is not None:
+            self.con.rollback()
+        self.cur.close()
+
+    @staticmethod
+    def close_all():
+        """ Close the connections opened by this process """
+        for key in [key for key in JobTable._connections
+                    if key[1] == os.getpid()]:
+            JobTable._connections.pop(key).close()
 
     def insert_record(self, record):
-        """ Insert a record into the table """
-        cmd = "insert into jobs(job_id, pid, ts, mach, stat, cmd) values" +\
+        """ Insert a (pid, ts, mach, stat, cmd[, threads]) record
+
+        Returns the new job id.
+        """
+        return self.insert_records([record])[0]
+
+    def insert_records(self, records):
+        """ Insert many records in one transaction, return their job ids """
+        cmd = "insert into jobs(pid, ts, mach, stat, cmd, threads) values" +\
             "(?, ?, ?, ?, ?, ?)"
-        self.cur.execute(cmd, record)
-        self.con.commit()
+        job_ids = []
+        try:
+            for record in records:
+                self.cur.execute(cmd, tuple(record) + (None,) *
+                                 (len(JobTable.columns) - 1 - len(record)))
+                job_ids.append(self.cur.lastrowid)
+            self.con.commit()
+        except:
+            self.con.rollback()
+            raise
+        return job_ids
 
     def get_jobs_by_status(self, status, all=False):
         """ Get jobs according to status - submitted/running/finished """
-        cmd = 'select * from jobs where stat="%s"' % status
+        cmd = 'select * from jobs where stat=?'
+        self.cur.execute(cmd, (status,))
+        return self.cur.fetchall()
+
+    def get_queued_jobs(self):
+        """ Get queued jobs, oldest first """
+        cmd = 'select * from jobs where stat="queued" order by job_id'
         self.cur.execute(cmd)
         return self.cur.fetchall()
 
+    def claim_jobs(self, assignment):
+        """ Mark assigned queued jobs as starting in one transaction
+
+        assignment maps host to job ids. Jobs that are no longer queued,
+        e.g. claimed by another scheduler, are skipped. Returns the map of
+        host to the job ids that were claimed.
+        """
+        now = datetime.datetime.now()
+        cmd = 'update jobs set stat="starting", mach=?, ts=? ' +\
+            'where job_id=? and stat="queued"'
+        claimed = {}
+        try:
+            for host, job_ids in assignment.items():
+                for job_id in job_ids:
+                    self.cur.execute(cmd, (host, now, job_id))
+                    if self.cur.rowcount:
+                        claimed.setdefault(host, []).append(job_id)
+            self.con.commit()
+        except:
+            self.con.rollback()
+            raise
+        return claimed
+
+    def get_used_slots(self, max_slots=None):
+        """ Map of host to the cores taken by its starting, submitted and
+        running jobs
+
+        A job takes its threads, at least one and at most max_slots, the
+        way SlotScheduler.slots_needed counts them.
+        """
+        cmd = 'select mach, sum(min(max(coalesce(threads, 1), 1), ?)) ' +\
+            'from jobs where stat in ("starting", "submitted", "running") ' +\
+            'and mach is not null group by mach'
+        self.cur.execute(cmd, (1 << 31 if max_slots is None else max_slots,))
+        return dict(self.cur.fetchall())
+
+    @staticmethod
+    def _job_filter(stat=None, mach=None, since=None, until=None):
+        """ Build a where clause and its parameters for job filters """
+        clauses, params = [], []
+        for clause, value in (("stat=?", stat), ("mach=?", mach),
+                              ("ts>=?", since), ("ts<?", until)):
+            if value is not None:
+                clauses.append(clause)
+                params.append(value)
+        where = " where " + " and ".join(clauses) if clauses else ""
+        return where, params
+
+    def count_jobs(self, **filters):
+        """ Count the jobs matching the filters of _job_filter """
+        where, params = JobTable._job_filter(**filters)
+        self.cur.execute("select count(*) from jobs" + where, params)
+        return self.cur.fetchone()[0]
+
+    def iter_job_pages(self, page_size, sort="ts", descending=True,
+                       **filters):
+        """ Yield lists of up to page_size matching jobs, sorted by sort """
+        sort = sort.lower()
+        if sort not in JobTable.columns:
+            raise ValueError("Unknown job column {0}, expected one of {1}".
+                             format(sort, ", ".join(JobTable.columns)))
+        where, params = JobTable._job_filter(**filters)
+        cmd = "select * from jobs" + where + " order by " + sort +\
+            (" desc" if descending else " asc") + ", job_id"
+        cur = self.con.cursor()
+        try:
+            cur.execute(cmd, params)
+            while True:
+                rows = cur.fetchmany(page_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            cur.close()
+
+    def insert_samples(self, samples):
+        """ Insert resource samples, tuples of sample_columns, at once """
+        cmd = "insert into job_samples(" + ", ".join(JobTable.sample_columns) +\
+            ") values(" + ", ".join("?" * len(JobTable.sample_columns)) + ")"
+        try:
+            self.cur.executemany(cmd, samples)
+            self.con.commit()
+        except:
+            self.con.rollback()
+            raise
+
+    def get_job_samples(self, jobid):
+        """ Resource samples of a job, oldest first """
+        cmd = "select * from job_samples where job_id=? order by ts"
+        self.cur.execute(cmd, (jobid,))
+        return self.cur.fetchall()
+
+    def get_job_usage(self):
+        """ (job_id, cmd, threads, peak rss, wall, cpu) of sampled jobs """
+        cmd = "select jobs.job_id, cmd, threads, " +\
+            "max(coalesce(peak_rss_kb, rss_kb)), max(etime), " +\
+            "max(cpu_seconds) from job_samples " +\
+            "join jobs on jobs.job_id=job_samples.job_id " +\
+            "group by jobs.job_id"
+        self.cur.execute(cmd)
+        return self.cur.fetchall()
+
+    def get_jobs_by_mach(self, mach):
+        """ Get all jobs that ran on a machine """
+        cmd = 'select * from jobs where mach=?'
+        self.cur.execute(cmd, (mach,))
+        return self.cur.fetchall()
+
     def get_job_by_jobid(self, jobid):
         """ Get jobs according to status - submitted/running/finished """
-        cmd = 'select * from jobs where job_id=%d' % jobid
-        self.cur.execute(cmd)
+        cmd = 'select * from jobs where job_id=?'
+        self.cur.execute(cmd, (jobid,))
         return self.cur.fetchall()[0]
 
     def get_all_jobs(self):
@@ -279,6 +1196,26 @@ class JobTable:
         JobTable.make_table(page, rows, header= JobTable.columns)
         return page.__str__()
 
+    @staticmethod
+    def page_name(page_no):
+        """ File name of a report page """
+        return "jobs-{:04d}.html".format(page_no)
+
+    @staticmethod
+    def encode_html_page(rows, page_no, num_pages):
+        """ Encode one page of a paginated report into html """
+        page = markup.page()
+        page.init(title="Job Table")
+        page.h2("Job Table - page {:d} of {:d}".format(page_no, num_pages))
+        page.p()
+        if page_no > 1:
+            page.a("previous", href=JobTable.page_name(page_no - 1))
+        if page_no < num_pages:
+            page.a("next", href=JobTable.page_name(page_no + 1))
+        page.p.close()
+        JobTable.make_table(page, rows, header=JobTable.columns)
+        return page.__str__()
+
     @staticmethod
     def make_table(page, rows, header=None):
         """ Make an HTML table for a markup page """
@@ -286,10 +1223,7 @@ class JobTable:
         page.tr()
         page.th(header)
         page.tr.close()
-        for row in rows:
-            page.tr()
-            page.td(row)
-            page.tr.close()
+        page.addrows(rows)
         page.table.close()
 
     def display_all(self):
@@ -299,23 +1233,74 @@ class JobTable:
         for line in self.cur.fetchall():
             print(line)
 
-    def _create_table(self):
-        """ Create a job table """
-        cmd = "create table if not exists jobs(job_id int, pid int, " +\
-            "ts timestamp, mach text, stat text, cmd text)"
-        self.cur.execute(cmd)
+    def _schema_version(self):
+        """ Return the version of the schema in the database file """
+        self.cur.execute("pragma user_version")
+        return self.cur.fetchone()[0]
+
+    def _migrate_schema(self):
+        """ Create the job table or bring it up to the latest version """
+        if self._schema_version() == len(JobTable.migrations):
+            return
+
+        # Run the migrations in one explicit transaction. The write lock
+        # taken by begin immediate keeps two fab processes from migrating
+        # the same file at once.
+        self.con.isolation_level = None
+        try:
+            self.cur.execute("begin immediate")
+            try:
+                version = self._schema_version()
+                for statements in JobTable.migrations[version:]:
+                    for statement in statements:
+                        self.cur.execute(statement)
+                self.cur.execute("pragma user_version=%d" %
+                                 len(JobTable.migrations))
+                self.cur.execute("commit")
+            except:
+                self.cur.execute("rollback")
+                raise
+        finally:
+            self.con.isolation_level = ""
 
     def _delete_table(self):
         """Delete the job table"""
         cmd = "drop table jobs"
         self.cur.execute()
 
+    def update_stats(self, updates):
+        """ Apply a map of job id to new status in one transaction """
+        if not updates:
+            return
+        cmd = "update jobs set stat=? where job_id=?"
+        self.cur.executemany(cmd, ((stat, jobid) for (jobid, stat)
+                                   in updates.iteritems()))
+        self.con.commit()
+
+    def update_records(self, updates):
+        """ Apply a map of job id to {column: value} in one transaction """
+        try:
+            for jobid, fields in updates.iteritems():
+                names = sorted(fields)
+                unknown = set(names) - set(JobTable.columns[1:])
+                if unknown:
+                    raise ValueError("Unknown job columns: " +
+                                     ", ".join(sorted(unknown)))
+                cmd = "update jobs set " +\
+                    ", ".join(name + "=?" for name in names) +\
+                    " where job_id=?"
+                self.cur.execute(cmd, [fields[name] for name in names] +
+                                 [jobid])
+            self.con.commit()
+        except:
+            self.con.rollback()
+            raise
+
     def update_stat(self, jobids, stat):
         """ updates values """
-        cmd = 'update jobs set stat="%s" ' % stat + 'where job_id in (' +\
-            ','.join(map(str, jobids)) + ')'
-        print cmd
-        self.cur.execute(cmd)
+        cmd = 'update jobs set stat=? where job_id in (' +\
+            ','.join('?' * len(jobids)) + ')'
+        self.cur.execute(cmd, [stat] + list(jobids))
         self.con.commit()
 
 if __name__ == '__main__':
@@ -332,11 +1317,9 @@ if __name__ == '__main__':
 
     with JobTable() as tbl:
         now = datetime.datetime.now()
-        max_job_id = tbl.get_max_jobid()
-        new_job_id = 1 if max_job_id is None else max_job_id+1
-        record = (new_job_id, 5300, now, "denovo-1", "submitted", "ls -la")
+        record = (5300, now, "denovo-1", "submitted", "ls -la")
         tbl.insert_record(record)
-        record = (new_job_id+1, 5301, now, "denovo-1", "submitted", "ls -la")
+        record = (5301, now, "denovo-1", "submitted", "ls -la")
         tbl.insert_record(record)
         for rec in tbl.get_jobs_by_status("submitted"):
             print rec
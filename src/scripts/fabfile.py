@@ -19,30 +19,39 @@ from fabric.api import *
 import utils
 import itertools
 
-# Instantiate helper objects
+# Instantiate helper objects. Both are lazy: credentials, the compute
+# service, the instance inventory and the job table are only loaded when a
+# task first uses them.
 helper = gce_helper.GCEHelper()
 denovo_helper = denovo_helper.DenovoHelper(helper)
 
-# Set up roles and environments
+# Set up roles and environments. Roles are callables so that the inventory
+# is only looked up for tasks that run on hosts.
 env.user = utils.constants["GCE_USER"]
 env.roledefs = {
     "denovo":
-    [ip for (name, ip) in helper.nameToIPMap.items() if 'denovo' in name],
+    lambda: [ip for (name, ip) in helper.nameToIPMap.items()
+             if 'denovo' in name],
     "single":
-    [ip for (name, ip) in helper.nameToIPMap.items() if name == 'denovo-1'],
+    lambda: [ip for (name, ip) in helper.nameToIPMap.items()
+             if name == 'denovo-1'],
     "gce": [],
-    "table": []
+    "table": [],
+    "fleet": []
 }
 env.disable_known_hosts = True
 env.key_filename = utils.constants["GCE_PRIVATE_KEY"]
 
+
+def _public_methods(obj):
+    """ Public methods of obj, found without touching its lazy properties """
+    return [(name, getattr(obj, name)) for (name, _) in
+            inspect.getmembers(type(obj), predicate=inspect.ismethod)
+            if not name.startswith("_")]
+
 # Add methods from helper classes to fabric namespace
-gce_methods = [tup for tup in
-               inspect.getmembers(helper, predicate=inspect.ismethod)
-               if not tup[0].startswith("_")]
-denovo_methods = [tup for tup in
-               inspect.getmembers(denovo_helper, predicate=inspect.ismethod)
-               if not tup[0].startswith("_")]
+gce_methods = _public_methods(helper)
+denovo_methods = _public_methods(denovo_helper)
 
 for tup in gce_methods:
     locals()[tup[0]] = roles("gce")(tup[1])
@@ -55,3 +64,6 @@ for tup in (tup for tup in denovo_methods if tup[0].startswith("single")):
 
 for tup in (tup for tup in denovo_methods if tup[0].startswith("table")):
     locals()[tup[0]] = roles("table")(tup[1])
+
+for tup in (tup for tup in denovo_methods if tup[0].startswith("fleet")):
+    locals()[tup[0]] = roles("fleet")(tup[1])
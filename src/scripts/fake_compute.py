@@ -0,0 +1,509 @@
+#!/usr/bin/env python
+#
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except
+# in compliance with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the License
+# is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+# or implied. See the License for the specific language governing permissions and limitations under
+# the License.
+
+""" Local stand-in for the Compute API and the denovo hosts
+
+One http server serves the instances, disks and operations endpoints that
+gce_helper.py uses, under /compute/v1/projects/. Lists take the name eq
+filter, page tokens and field masks. Operations finish after a configurable
+latency and fail at a configurable rate.
+
+Every running instance is also a simulated host. POST /ssh/<natIP> with a
+shell command as the body runs it the way a denovo host would for the
+nohup, ps, /proc, kill and mkdir commands that DenovoHelper sends.
+"""
+
+import BaseHTTPServer
+import SocketServer
+import json
+import random
+import re
+import threading
+import time
+import urlparse
+
+PREFIX = "/compute/v1/projects/"
+
+# seconds until an operation is done, by operation kind
+DEFAULT_LATENCY = {
+    "insert_disk": 2.0,
+    "insert_instance": 5.0,
+    "delete_disk": 2.0,
+    "delete_instance": 5.0,
+    "bulk_insert_instance": 10.0,
+}
+
+
+class FakeCompute(object):
+
+    """ Instances, disks and operations of one fake project """
+
+    def __init__(self, latency=None, failure_rate=None, jitter=0.25,
+                 api_latency=0.0, ssh_latency=0.0, job_duration=3600.0,
+                 page_size=500, seed=0):
+        self.latency = dict(DEFAULT_LATENCY)
+        self.latency.update(latency or {})
+        self.failure_rate = failure_rate or {}
+        self.jitter = jitter
+        self.api_latency = api_latency
+        self.ssh_latency = ssh_latency
+        self.job_duration = job_duration
+        self.page_size = page_size
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.instances = {}
+        self.disks = {}
+        # operation name -> [operation, done at, effect, error]
+        self.operations = {}
+        self.hosts = {}
+        self.counters = {"requests": 0, "ssh_commands": 0, "operations": 0}
+        self._next_op = 0
+        self._next_ip = 0
+
+    def _operation(self, base, project, zone, kind, target, effect):
+        """ Start an operation that applies effect once it is done """
+        self._next_op += 1
+        self.counters["operations"] += 1
+        name = "operation-{:d}".format(self._next_op)
+        zone_url = base + project + "/zones/" + zone
+        operation = {
+            "kind": "compute#operation", "name": name, "zone": zone_url,
+            "operationType": kind.split("_")[0],
+            "targetLink": zone_url + "/" + target,
+            "status": "RUNNING",
+            "selfLink": zone_url + "/operations/" + name,
+        }
+        latency = self.latency.get(kind, 1.0)
+        latency *= 1 + self.rng.uniform(-self.jitter, self.jitter)
+        error = None
+        if self.rng.random() < self.failure_rate.get(kind, 0.0):
+            error = {"code": "SIMULATED_FAILURE",
+                     "message": "Simulated failure of " + kind}
+        self.operations[name] = [operation, time.time() + latency, effect,
+                                 error]
+        return dict(operation)
+
+    def _advance(self):
+        """ Finish the operations whose time has come, in start order """
+        now = time.time()
+        due = sorted((entry[1], name) for (name, entry)
+                     in self.operations.items()
+                     if entry[0]["status"] != "DONE" and entry[1] <= now)
+        for _, name in due:
+            operation, _, effect, error = self.operations[name]
+            if error is None:
+                error = effect()
+            operation["status"] = "DONE"
+            if error is not None:
+                operation["error"] = {"errors": [error]}
+
+    def _new_ip(self):
+        self._next_ip += 1
+        return "10.{0:d}.{1:d}.{2:d}".format(
+            self._next_ip >> 16 & 255, self._next_ip >> 8 & 255,
+            self._next_ip & 255)
+
+    def insert_disk(self, base, project, zone, body):
+        name = body["name"]
+
+        def effect():
+            if name in self.disks:
+                return {"code": "RESOURCE_ALREADY_EXISTS", "message": name}
+            self.disks[name] = dict(body, status="READY", users=[])
+        return self._operation(base, project, zone, "insert_disk",
+                               "disks/" + name, effect)
+
+    def delete_disk(self, base, project, zone, name):
+        def effect():
+            disk = self.disks.get(name)
+            if disk is None:
+                return {"code": "RESOURCE_NOT_FOUND", "message": name}
+            if disk["users"]:
+                return {"code": "RESOURCE_IN_USE_BY_ANOTHER_RESOURCE",
+                        "message": name}
+            del self.disks[name]
+        return self._operation(base, project, zone, "delete_disk",
+                               "disks/" + name, effect)
+
+    def _create_instance(self, name, body, template=False):
+        """ Add an instance and its host, return an error or None
+
+        Like GCE, only a bulkInsert template takes bare disk type names.
+        """
+        if name in self.instances:
+            return {"code": "RESOURCE_ALREADY_EXISTS", "message": name}
+        disks = []
+        for disk in body.get("disks", []):
+            disk_type = disk.get("initializeParams", {}).get("diskType")
+            if disk_type and "/" not in disk_type and not template:
+                return {"code": "INVALID_FIELD_VALUE",
+                        "message": "Invalid value for field "
+                        "'resource.disks[].initializeParams.diskType': " +
+                        disk_type}
+            if "source" in disk:
+                disk_name = disk["source"].split("/")[-1]
+            else:
+                # boot disk created inline from initializeParams
+                disk_name = disk.get("initializeParams", {}).get(
+                    "diskName", name)
+                if disk_name in self.disks:
+                    return {"code": "RESOURCE_ALREADY_EXISTS",
+                            "message": "disk " + disk_name}
+                self.disks[disk_name] = {"name": disk_name,
+                                         "status": "READY", "users": []}
+            if disk_name not in self.disks:
+                return {"code": "RESOURCE_NOT_FOUND",
+                        "message": "disk " + disk_name}
+            disks.append(disk_name)
+        for disk_name in disks:
+            self.disks[disk_name]["users"].append(name)
+        ip = self._new_ip()
+        self.instances[name] = {
+            "kind": "compute#instance", "name": name,
+            "status": "RUNNING", "zone": body.get("zone"),
+            "machineType": body.get("machineType"),
+            "disks": body.get("disks", []),
+            "networkInterfaces": [{"networkIP": "192.168.0.1",
+                                   "accessConfigs": [{
+                                       "name": "External NAT",
+                                       "type": "ONE_TO_ONE_NAT",
+                                       "natIP": ip}]}],
+            "_disk_names": disks,
+        }
+        self.hosts[ip] = FakeHost(self.job_duration, self.rng.random())
+
+    def insert_instance(self, base, project, zone, body):
+        name = body["name"]
+        return self._operation(base, project, zone, "insert_instance",
+                               "instances/" + name,
+                               lambda: self._create_instance(name, body))
+
+    def bulk_insert_instances(self, base, project, zone, body):
+        """ One operation that creates every perInstanceProperties name """
+        names = sorted(body.get("perInstanceProperties", {}))
+
+        def effect():
+            errors = [self._create_instance(name, dict(
+                body["instanceProperties"], name=name), template=True)
+                for name in names]
+            errors = [error for error in errors if error is not None]
+            return errors[0] if errors else None
+        return self._operation(base, project, zone, "bulk_insert_instance",
+                               "instances", effect)
+
+    def delete_instance(self, base, project, zone, name):
+        def effect():
+            instance = self.instances.pop(name, None)
+            if instance is None:
+                return {"code": "RESOURCE_NOT_FOUND", "message": name}
+            ip = instance["networkInterfaces"][0]["accessConfigs"][0]["natIP"]
+            self.hosts.pop(ip, None)
+            for disk_name, disk in zip(instance["_disk_names"],
+                                       instance["disks"]):
+                self.disks[disk_name]["users"].remove(name)
+                if disk.get("autoDelete"):
+                    del self.disks[disk_name]
+        return self._operation(base, project, zone, "delete_instance",
+                               "instances/" + name, effect)
+
+    def list(self, collection, params):
+        """ One page of instances or disks, filtered by name eq <regex> """
+        items = sorted(collection.values(), key=lambda item: item["name"])
+        match = re.match(r"name\s+eq\s+(\S+)$",
+                         params.get("filter", "").strip())
+        if match:
+            items = [item for item in items
+                     if re.match(match.group(1) + "$", item["name"])]
+        start = int(params.get("pageToken") or 0)
+        size = min(int(params.get("maxResults") or self.page_size),
+                   self.page_size)
+        response = {"items": [dict((k, v) for (k, v) in item.items()
+                                   if not k.startswith("_"))
+                              for item in items[start:start + size]]}
+        if start + size < len(items):
+            response["nextPageToken"] = str(start + size)
+        return response
+
+    def get_operation(self, name):
+        entry = self.operations.get(name)
+        return None if entry is None else dict(entry[0])
+
+    def ssh(self, ip, cmd):
+        """ Run a command on a simulated host, None if there is no host """
+        host = self.hosts.get(ip)
+        if host is None:
+            return None
+        self.counters["ssh_commands"] += 1
+        return host.run(cmd)
+
+
+class FakeHost(object):
+
+    """ Process table of one simulated denovo host """
+
+    clock_ticks = 100
+
+    def __init__(self, job_duration, seed):
+        self.job_duration = job_duration
+        self.booted = time.time()
+        self.rng = random.Random(seed)
+        # pid -> (cmd, start time, end time, rss in KB)
+        self.processes = {}
+        self.next_pid = 1000
+
+    def _alive(self):
+        now = time.time()
+        for pid in [pid for (pid, proc) in self.processes.items()
+                    if proc[2] <= now]:
+            del self.processes[pid]
+        return self.processes
+
+    @staticmethod
+    def _ps_time(seconds):
+        seconds = int(seconds)
+        days, seconds = divmod(seconds, 86400)
+        clock = "{0:02d}:{1:02d}:{2:02d}".format(
+            seconds // 3600, seconds // 60 % 60, seconds % 60)
+        return "{0:d}-{1}".format(days, clock) if days else clock
+
+    def run(self, cmd):
+        alive = self._alive()
+        now = time.time()
+        launch = re.match(r"\(nohup (.*) 2>\S+ 1>\S+ <\S+ & \);", cmd)
+        if launch:
+            self.next_pid += 1
+            self.processes[self.next_pid] = (
+                launch.group(1), now,
+                now + self.job_duration * self.rng.uniform(0.5, 1.5),
+                self.rng.randint(500000, 4000000))
+            return "{0:d} ? Sl 0:00 {1}".format(self.next_pid,
+                                               launch.group(1))
+        probe = re.match(r"ps -o pid=,etime=,time=,rss= -p ([\d,]+)", cmd)
+        if probe:
+            lines = []
+            for pid in map(int, probe.group(1).split(",")):
+                if pid in alive:
+                    elapsed = now - alive[pid][1]
+                    lines.append("{0:d} {1} {2} {3:d}".format(
+                        pid, FakeHost._ps_time(elapsed),
+                        FakeHost._ps_time(elapsed * 0.9), alive[pid][3]))
+            return "\n".join(lines)
+        sample = re.match(r"echo clk .*for p in ([\d ]+);", cmd)
+        if sample:
+            uptime = now - self.booted + 1000
+            lines = ["clk {0:d} {1:.2f}".format(FakeHost.clock_ticks,
+                                                uptime)]
+            for pid in map(int, sample.group(1).split()):
+                if pid not in alive:
+                    continue
+                _, started, _, rss = alive[pid]
+                ticks = int((now - started) * 0.9 * FakeHost.clock_ticks)
+                start_ticks = int((uptime - (now - started)) *
+                                  FakeHost.clock_ticks)
+                stat = ["S"] + ["0"] * 19
+                stat[11], stat[12] = str(ticks), "0"
+                stat[19] = str(start_ticks)
+                lines += ["pid {0:d}".format(pid), " ".join(stat),
+                          "VmRSS: {0:d} kB".format(rss),
+                          "VmHWM: {0:d} kB".format(rss),
+                          "read_bytes: 0", "write_bytes: 0"]
+            return "\n".join(lines)
+        exists = re.match(r"\[ -e /proc/(\d+) \]", cmd)
+        if exists:
+            return "1" if int(exists.group(1)) in alive else "0"
+        kill = re.match(r"kill -9 (\d+)", cmd)
+        if kill:
+            self.processes.pop(int(kill.group(1)), None)
+        return ""
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, code, body):
+        out = body if isinstance(body, str) else json.dumps(body)
+        self.send_response(code)
+        self.send_header("content-type", "application/json")
+        self.send_header("content-length", str(len(out)))
+        self.end_headers()
+        self.wfile.write(out)
+
+    def _body(self):
+        length = int(self.headers.get("content-length") or 0)
+        return self.rfile.read(length) if length else ""
+
+    def _handle(self):
+        fake = self.server.fake
+        url = urlparse.urlsplit(self.path)
+        params = dict(urlparse.parse_qsl(url.query))
+        body = self._body()
+
+        if url.path.startswith("/ssh/"):
+            if fake.ssh_latency:
+                time.sleep(fake.ssh_latency)
+            with fake.lock:
+                out = fake.ssh(url.path[len("/ssh/"):], body)
+            if out is None:
+                self._reply(404, "no such host")
+            else:
+                self._reply(200, out)
+            return
+
+        if fake.api_latency:
+            time.sleep(fake.api_latency)
+        base = "http://{0}:{1:d}{2}".format(
+            self.server.server_address[0], self.server.server_address[1],
+            PREFIX)
+        parts = url.path[len(PREFIX):].split("/") \
+            if url.path.startswith(PREFIX) else []
+        with fake.lock:
+            fake.counters["requests"] += 1
+            fake._advance()
+            response = self._route(fake, base, self.command, parts, params,
+                                   json.loads(body) if body else None)
+        if response is None:
+            self._reply(404, {"error": {"code": 404, "message": self.path}})
+        else:
+            if params.get("fields"):
+                response = select_fields(response,
+                                         parse_fields(params["fields"]))
+            self._reply(200, response)
+
+    def _route(self, fake, base, method, parts, params, body):
+        """ Dispatch projects/<project>/... paths """
+        if len(parts) < 2:
+            return None
+        project, rest = parts[0], parts[1:]
+        if rest[:2] == ["global", "operations"] and len(rest) == 3:
+            return fake.get_operation(rest[2])
+        if rest[0] != "zones" or len(rest) < 3:
+            return None
+        zone, collection, name = rest[1], rest[2], \
+            rest[3] if len(rest) > 3 else None
+        if collection == "operations" and name and method == "GET":
+            return fake.get_operation(name)
+        if collection not in ("instances", "disks"):
+            return None
+        items = fake.instances if collection == "instances" else fake.disks
+        kind = collection[:-1]
+        if name is None and method == "GET":
+            return fake.list(items, params)
+        if name == "bulkInsert" and method == "POST":
+            return fake.bulk_insert_instances(base, project, zone, body)
+        if name is None and method == "POST":
+            return getattr(fake, "insert_" + kind)(base, project, zone, body)
+        if name is not None and method == "DELETE":
+            return getattr(fake, "delete_" + kind)(base, project, zone, name)
+        if name is not None and method == "GET" and name in items:
+            return dict((k, v) for (k, v) in items[name].items()
+                        if not k.startswith("_"))
+        return None
+
+    do_GET = do_POST = do_DELETE = _handle
+
+
+class FakeServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, fake, port=0, host="127.0.0.1"):
+        BaseHTTPServer.HTTPServer.__init__(self, (host, port), Handler)
+        self.fake = fake
+
+    def base_url(self):
+        return "http://{0}:{1:d}{2}".format(
+            self.server_address[0], self.server_address[1], PREFIX)
+
+    def ssh_url(self):
+        return "http://{0}:{1:d}/ssh/".format(*self.server_address)
+
+
+def parse_rates(value):
+    """ Parse kind=value,kind=value into a dict of floats """
+    rates = {}
+    for item in filter(None, (value or "").split(",")):
+        kind, _, rate = item.partition("=")
+        rates[kind.strip()] = float(rate)
+    return rates
+
+def parse_fields(value):
+    """ Parse a field mask such as items(name,a/b),next into a nested dict
+
+    An empty dict selects the whole value.
+    """
+    tokens = re.findall(r"[^,()/\s]+|[,()/]", value)
+
+    def parse(pos):
+        tree = {}
+        while pos < len(tokens):
+            path = [tokens[pos]]
+            pos += 1
+            while pos < len(tokens) and tokens[pos] == "/":
+                path.append(tokens[pos + 1])
+                pos += 2
+            sub = {}
+            if pos < len(tokens) and tokens[pos] == "(":
+                sub, pos = parse(pos + 1)
+                pos += 1
+            node = tree
+            for name in path[:-1]:
+                node = node.setdefault(name, {})
+            node.setdefault(path[-1], {}).update(sub)
+            if pos < len(tokens) and tokens[pos] == ",":
+                pos += 1
+            else:
+                break
+        return tree, pos
+    return parse(0)[0]
+
+
+def select_fields(value, tree):
+    """ Keep only the fields of a parsed mask, through lists """
+    if not tree:
+        return value
+    if isinstance(value, list):
+        return [select_fields(item, tree) for item in value]
+    if isinstance(value, dict):
+        return dict((k, select_fields(value[k], sub))
+                    for (k, sub) in tree.items() if k in value)
+    return value
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+    parser = ArgumentParser(description="Fake Compute API and denovo hosts")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=str, default="",
+                        help="Operation seconds, e.g. insert_instance=5")
+    parser.add_argument("--failure_rate", type=str, default="",
+                        help="Operation failure rates, e.g. insert_disk=0.01")
+    parser.add_argument("--api_latency", type=float, default=0.0,
+                        help="Seconds added to every API request")
+    parser.add_argument("--ssh_latency", type=float, default=0.0,
+                        help="Seconds added to every host command")
+    parser.add_argument("--job_duration", type=float, default=3600.0,
+                        help="Mean seconds a simulated job runs")
+    args = parser.parse_args()
+
+    server = FakeServer(FakeCompute(
+        latency=parse_rates(args.latency),
+        failure_rate=parse_rates(args.failure_rate),
+        api_latency=args.api_latency, ssh_latency=args.ssh_latency,
+        job_duration=args.job_duration), port=args.port)
+    print "Serving {0} and {1}".format(server.base_url(), server.ssh_url())
+    server.serve_forever()
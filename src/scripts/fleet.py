@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+#
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except
+# in compliance with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the License
+# is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+# or implied. See the License for the specific language governing permissions and limitations under
+# the License.
+
+import time
+from collections import namedtuple
+
+from fabric.api import env, execute, hide, parallel, settings
+
+
+class HostError(Exception):
+
+    """ Raised instead of aborting when a command fails on a fleet host """
+    pass
+
+# Outcome of running a function on one host. output is whatever the function
+# returned, which is the command's stdout for remote commands.
+HostResult = namedtuple("HostResult",
+                        ["host", "succeeded", "output", "duration", "error"])
+
+
+def run_parallel(func, hosts, pool_size=10, timeout=None, *args, **kwargs):
+    """ Run func on every host with a bounded pool of worker processes
+
+    Keyword arguments:
+    pool_size -- max number of hosts worked on at once (default 10)
+    timeout -- seconds a remote command may run before it fails the host
+
+    Returns a map of host to HostResult. A failing host does not stop the
+    others.
+    """
+    if not hosts:
+        return {}
+
+    def task():
+        start = time.time()
+        try:
+            with settings(hide('running'), command_timeout=timeout,
+                          abort_exception=HostError):
+                output = func(*args, **kwargs)
+        except Exception as e:
+            return HostResult(env.host, False, None, time.time() - start,
+                              "{0}: {1}".format(type(e).__name__, e))
+        return HostResult(env.host, True, output, time.time() - start, None)
+
+    pool_size = min(int(pool_size), len(hosts))
+    return execute(parallel(pool_size=pool_size)(task), hosts=list(hosts))
+
+
+def print_results(results, names=None):
+    """ Print one summary line per host, slowest first """
+    names = {} if names is None else names
+    for result in sorted(results.values(), key=lambda r: -r.duration):
+        print "{0:<20} {1:<6} {2:8.1f}s {3}".format(
+            names.get(result.host, result.host),
+            "OK" if result.succeeded else "FAILED",
+            result.duration,
+            "" if result.succeeded else result.error.split("\n")[0])
+    failed = sum(1 for result in results.values() if not result.succeeded)
+    print "{0:d} hosts, {1:d} failed".format(len(results), failed)
@@ -14,18 +14,26 @@
 
 import argparse
 import logging
+import os
 import re
 import copy
 
 import httplib2
-from apiclient.discovery import build
+from apiclient.discovery import DISCOVERY_URI
+from apiclient.discovery import build_from_document
+from apiclient.errors import HttpError
 from oauth2client import tools
 from oauth2client.client import flow_from_clientsecrets
 from oauth2client.file import Storage
 from oauth2client.tools import run_flow
 
+from compute_client import ComputeClient
+from inventory import InventoryCache
+from operation_watcher import OperationWatcher
+from planner import machine_cores
 from utils import confirm
 from utils import constants
+from utils import str_to_bool
 
 
 class GCEHelper(object):
@@ -72,19 +80,86 @@ class GCEHelper(object):
          {"email": "default", "scopes":
           ["https://www.googleapis.com/auth/devstorage.read_only"]}]}
 
+    # instances().bulkInsert accepts at most this many instances per call
+    max_bulk_insert = 1000
+
+    # Listings ask GCE for the denovo-N resources only, and for instances
+    # only the fields of an inventory record
+    denovo_filter = "name eq denovo-[0-9]+"
+    inventory_fields = ("items(name,status,machineType,"
+                        "networkInterfaces/accessConfigs/natIP),nextPageToken")
+
     def __init__(self):
-        self.gce_service = None
-        self.auth_http = None
-        self._build_service()
+        # The service, credentials and inventory are only set up the first
+        # time a task needs them, so listing tasks stays instant.
+        logging.basicConfig(level=logging.WARNING)
+        self._gce_service = None
+        self._auth_http = None
+        self._watcher = None
+        self._client = None
+        self._credentials = None
         self.logger = logging.getLogger('gce_helper')
         self.logger.setLevel(logging.INFO)
-        self.nameToIPMap = {}
-        self.IPtoNameMap = {}
-        self._updateNameToIPMap()
+        self.inventory = InventoryCache()
+        self._instances = None
+        self._nameToIPMap = {}
+        self._IPtoNameMap = {}
+
+    @property
+    def gce_service(self):
+        if self._gce_service is None:
+            self._build_service()
+        return self._gce_service
+
+    @property
+    def auth_http(self):
+        if self._auth_http is None:
+            self._build_service()
+        return self._auth_http
+
+    @property
+    def client(self):
+        """ Concurrent REST client, against COMPUTE_BASE_URL if it is set """
+        if self._client is None:
+            if constants["COMPUTE_BASE_URL"] is None:
+                # authorizing sets up the credentials the client refreshes
+                self.auth_http
+            self._client = ComputeClient(
+                self._credentials, base_url=constants["COMPUTE_BASE_URL"],
+                max_concurrency=constants["COMPUTE_MAX_CONCURRENCY"])
+        return self._client
+
+    @property
+    def watcher(self):
+        if self._watcher is None:
+            if constants["COMPUTE_BASE_URL"] is None:
+                self._watcher = OperationWatcher(self.gce_service,
+                                                 self.auth_http)
+            else:
+                # a stub server has no batch endpoint
+                self._watcher = OperationWatcher(None, None,
+                                                 client=self.client)
+        return self._watcher
+
+    @property
+    def instances(self):
+        if self._instances is None:
+            self._load_inventory()
+        return self._instances
+
+    @property
+    def nameToIPMap(self):
+        if self._instances is None:
+            self._load_inventory()
+        return self._nameToIPMap
+
+    @property
+    def IPtoNameMap(self):
+        if self._instances is None:
+            self._load_inventory()
+        return self._IPtoNameMap
 
     def _build_service(self):
-        logging.basicConfig(level=logging.WARNING)
-
         parser = argparse.ArgumentParser(
             description=__doc__,
             formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -102,23 +177,39 @@ class GCEHelper(object):
 
         if credentials is None or credentials.invalid:
             credentials = run_flow(flow, storage, flags)
+        self._credentials = credentials
         http = httplib2.Http()
-        self.auth_http = credentials.authorize(http)
+        self._auth_http = credentials.authorize(http)
 
-        # Build the service
-        self.gce_service = build('compute', constants["API_VERSION"])
+        # Build the service from the locally cached discovery document
+        self._gce_service = build_from_document(
+            GCEHelper._discovery_document(), http=self._auth_http)
+
+    @staticmethod
+    def _discovery_document():
+        """ Return the compute discovery document, fetching it only once """
+        path = constants["DISCOVERY_CACHE"]
+        if os.path.exists(path):
+            with open(path) as fin:
+                return fin.read()
+
+        uri = DISCOVERY_URI.format(api='compute',
+                                   apiVersion=constants["API_VERSION"])
+        resp, content = httplib2.Http().request(uri)
+        if resp.status >= 400:
+            raise HttpError(resp, content, uri=uri)
+
+        directory = os.path.dirname(path)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        with open(path + ".tmp", "w") as fout:
+            fout.write(content)
+        os.rename(path + ".tmp", path)
+        return content
 
     def _list_instances(self):
-        # List instances
-        request = self.gce_service.instances(). list(
-            project=constants["PROJECT_ID"],
-            filter=None,
-            zone=constants["DEFAULT_ZONE"])
-        response = request.execute(http=self.auth_http)
-        if response and 'items' in response:
-            instances = response['items']
-            for instance in instances:
-                yield instance['name']
+        for instance in self.instances:
+            yield instance['name']
 
     def gce_list_denovo_instances(self) :
         """ Lists all the denovo instances """
@@ -135,27 +226,25 @@ class GCEHelper(object):
             if 'denovo' in instance:
                 yield instance
 
+    def _insert_instance(self, instance_json):
+        """ Submit an instance insert and return the pending operation """
+        self.logger.info("Creating instance {:s}".format(instance_json["name"]))
+        return self.client.insert_instance(instance_json).get()
+
+    def _insert_disk(self, disk_json):
+        """ Submit a disk insert and return the pending operation """
+        self.logger.info("Creating disk {:s}".format(disk_json["name"]))
+        return self.client.insert_disk(disk_json).get()
+
     def _create_instance(self, instance_json):
         """ Create a new instance from json """
-        self.logger.info("Creating instance {:s}".format(instance_json["name"]))
-        request = self.gce_service.instances().insert(
-            project=constants["PROJECT_ID"],
-            body=instance_json,
-            zone=constants["DEFAULT_ZONE"])
-        response = request.execute(http=self.auth_http)
-        response = self._blocking_call(self.gce_service, self.auth_http,
-                                        response)
+        response = self._insert_instance(instance_json)
+        response = self._blocking_call(response)
 
     def _create_disk(self, disk_json):
         """ Create a new disk from json """
-        self.logger.info("Creating disk {:s}".format(disk_json["name"]))
-        request = self.gce_service.disks().insert(
-            project=constants["PROJECT_ID"],
-            body=disk_json,
-            zone=constants["DEFAULT_ZONE"])
-        response = request.execute(http=self.auth_http)
-        response = self._blocking_call(self.gce_service, self.auth_http,
-                                        response)
+        response = self._insert_disk(disk_json)
+        response = self._blocking_call(response)
 
     def _create_instance_json(self, instance_name, device_name, num_cores):
         """ Creates a REST Json object to create a new instance"""
@@ -177,6 +266,52 @@ class GCEHelper(object):
             **instance_constants)
         return instance_json
 
+    def _create_inline_instance_json(self, instance_name, num_cores):
+        """ Instance json whose boot disk is created from the snapshot
+
+        The disk gets the instance's name and is made by the instance
+        insert itself, so no separate disk operation is needed.
+        """
+        instance_json = self._create_instance_json(instance_name,
+                                                   instance_name, num_cores)
+        disk = instance_json["disks"][0]
+        del disk["source"]
+        disk["initializeParams"] = GCEHelper._boot_disk_params()
+        disk["initializeParams"]["diskName"] = instance_name
+        return instance_json
+
+    @staticmethod
+    def _boot_disk_params():
+        """ initializeParams that create a boot disk from SNAPSHOT_NAME
+
+        instances().insert needs the disk type as a zonal url, only a
+        bulkInsert template takes its bare name.
+        """
+        return {"sourceSnapshot": GCEHelper.new_disk_json["sourceSnapshot"],
+                "diskType": GCEHelper.new_disk_json["type"]}
+
+    def _bulk_insert_json(self, instance_names, num_cores):
+        """ One bulkInsert request body for identically shaped instances
+
+        The instance template is new_instance_json with its boot disk
+        created inline, and every name gets its own perInstanceProperties
+        entry. Boot disks are named after their instances.
+        """
+        properties = copy.deepcopy(GCEHelper.new_instance_json)
+        for key in ("name", "zone"):
+            del properties[key]
+        properties["machineType"] = "n1-standard-{0}".format(num_cores)
+        disk = properties["disks"][0]
+        for key in ("deviceName", "source", "zone"):
+            del disk[key]
+        disk["initializeParams"] = GCEHelper._boot_disk_params()
+        disk["initializeParams"]["diskType"] = \
+            disk["initializeParams"]["diskType"].split('/')[-1]
+        return {"count": len(instance_names),
+                "instanceProperties": properties,
+                "perInstanceProperties": dict((name, {})
+                                              for name in instance_names)}
+
     def _create_disk_json(self, device_name):
         """ Creates a REST Json object to create a new disk"""
         disk_json = copy.deepcopy(GCEHelper.new_disk_json)
@@ -187,24 +322,185 @@ class GCEHelper(object):
 
         return disk_json
 
-    def gce_create_denovo_instances(self, num_instances=1, num_cores=4):
+    def gce_create_denovo_instances(self, num_instances=1, num_cores=4,
+                                    parallel=False, max_parallel=10,
+                                    inline=False, bulk=False):
         """ Create new denovo instances
 
         Keyword arguments:
         num_instances -- the number of instances (default 1)
         num_cores -- the number of cores per instance (default 4)
+        parallel -- provision all instances concurrently (default False)
+        max_parallel -- max operations in flight when parallel (default 10)
+        inline -- create each boot disk from the snapshot as part of the
+                  instance insert, one operation per instance (default False)
+        bulk -- create all instances with bulkInsert requests built from one
+                template, boot disks inline (default False)
         """
         self.logger.info("Creating instances...")
 
         num_instances = int(num_instances)
+        # number from a live listing, the cache may not know every instance
+        self._updateNameToIPMap()
         new_instance_start_number = self._get_max_denovo_number() + 1
-        for instance_idx in xrange(new_instance_start_number,
-                                   new_instance_start_number+num_instances):
-            device_name = "denovo-{:d}".format(instance_idx)
-            instance_name = "denovo-{:d}".format(instance_idx)
-            self._create_disk(self._create_disk_json(device_name))
-            self._create_instance(self._create_instance_json(
-                instance_name, device_name, num_cores))
+        instance_names = ["denovo-{:d}".format(instance_idx) for instance_idx
+                          in xrange(new_instance_start_number,
+                                    new_instance_start_number+num_instances)]
+
+        inline = str_to_bool(inline)
+        try:
+            if str_to_bool(bulk) or str_to_bool(parallel):
+                if str_to_bool(bulk):
+                    results = self._bulk_create_instances(instance_names,
+                                                          num_cores)
+                else:
+                    results = self._create_instances_concurrently(
+                        instance_names, num_cores, int(max_parallel), inline)
+                for instance_name in instance_names:
+                    print("{0}: {1}".format(instance_name,
+                                            results[instance_name]))
+                return results
+
+            for instance_name in instance_names:
+                if inline:
+                    self._create_instance(self._create_inline_instance_json(
+                        instance_name, num_cores))
+                    continue
+                device_name = instance_name
+                self._create_disk(self._create_disk_json(device_name))
+                self._create_instance(self._create_instance_json(
+                    instance_name, device_name, num_cores))
+        finally:
+            # new instances get their ips assigned by GCE, so the next
+            # lookup lists them again, in this process too
+            self.inventory.invalidate()
+            self._instances = None
+
+    def _bulk_create_instances(self, instance_names, num_cores):
+        """ Create instances with as few bulkInsert requests as possible
+
+        The requests go out together and their operations are waited on
+        together. Returns a map of instance name to outcome.
+        """
+        chunks = [instance_names[start:start + GCEHelper.max_bulk_insert]
+                  for start in xrange(0, len(instance_names),
+                                      GCEHelper.max_bulk_insert)]
+        self.logger.info("Creating {0:d} instances in {1:d} bulk requests".
+                         format(len(instance_names), len(chunks)))
+        operations = self.client.wait_all(
+            [self.client.bulk_insert_instances(
+                self._bulk_insert_json(names, num_cores)) for names in chunks])
+
+        results = {}
+
+        def on_done(names, operation):
+            if 'error' in operation:
+                results.update((name, "FAILED: " +
+                                GCEHelper._operation_error(operation))
+                               for name in names)
+
+        for names, operation in zip(chunks, operations):
+            if isinstance(operation, HttpError):
+                results.update((name, "FAILED: {0}".format(operation))
+                               for name in names)
+            elif isinstance(operation, Exception):
+                raise operation
+            else:
+                self.watcher.add(operation, callback=lambda operation,
+                                 names=names: on_done(names, operation))
+        self.watcher.wait()
+        self.logger.info("Operation stats: {0}".format(self.watcher.stats()))
+
+        # a bulk insert can partly succeed, so check what exists now
+        self._updateNameToIPMap()
+        created = set(self._list_instances())
+        for name in instance_names:
+            if name in created:
+                results[name] = "CREATED"
+            elif name not in results:
+                results[name] = "FAILED: not created"
+        return results
+
+    def _create_instances_concurrently(self, instance_names, num_cores,
+                                       max_parallel, inline=False):
+        """ Provision instances with at most max_parallel operations in flight
+
+        Every disk insert is submitted as soon as there is room under the
+        cap, and the instance insert for a disk is submitted as soon as that
+        disk operation is done. With inline the instance inserts create
+        their boot disks and go out right away. Returns a map of instance
+        name to outcome.
+        """
+        if max_parallel < 1:
+            raise ValueError("max_parallel should be at least 1")
+
+        results = {}
+        waiting = list(instance_names)
+        active = set()
+
+        def fill():
+            # all the disk inserts that fit under the cap go out at once
+            names = []
+            while waiting and len(active) < max_parallel:
+                instance_name = waiting.pop(0)
+                active.add(instance_name)
+                names.append(instance_name)
+            if not names:
+                return
+            if inline:
+                self.logger.info("Creating instances {0}".format(
+                    ", ".join(names)))
+                operations = self.client.wait_all(
+                    [self.client.insert_instance(
+                        self._create_inline_instance_json(name, num_cores))
+                     for name in names])
+                for instance_name, operation in zip(names, operations):
+                    track("instance", instance_name, operation)
+                return
+            self.logger.info("Creating disks {0}".format(", ".join(names)))
+            operations = self.client.wait_all(
+                [self.client.insert_disk(self._create_disk_json(name))
+                 for name in names])
+            for instance_name, operation in zip(names, operations):
+                track("disk", instance_name, operation)
+
+        def track(stage, instance_name, operation):
+            if isinstance(operation, HttpError):
+                finish(instance_name, "FAILED ({0}): {1}".format(
+                    stage, operation))
+                return
+            if isinstance(operation, Exception):
+                raise operation
+            self.watcher.add(operation, callback=lambda operation:
+                             on_done(stage, instance_name, operation))
+
+        def finish(instance_name, outcome):
+            results[instance_name] = outcome
+            active.discard(instance_name)
+            fill()
+
+        def submit(stage, instance_name, insert, body):
+            try:
+                operation = insert(body)
+            except HttpError as e:
+                operation = e
+            track(stage, instance_name, operation)
+
+        def on_done(stage, instance_name, operation):
+            if 'error' in operation:
+                finish(instance_name, "FAILED ({0}): {1}".format(
+                    stage, GCEHelper._operation_error(operation)))
+            elif stage == "disk":
+                submit("instance", instance_name, self._insert_instance,
+                       self._create_instance_json(
+                           instance_name, instance_name, num_cores))
+            else:
+                finish(instance_name, "CREATED")
+
+        fill()
+        self.watcher.wait()
+        self.logger.info("Operation stats: {0}".format(self.watcher.stats()))
+        return results
 
     def gce_delete_all_denovo_instances(self):
         """ Deletes all denovo instances """
@@ -212,44 +508,118 @@ class GCEHelper(object):
         self.logger.info("Deleting all denovo instances...")
         if not confirm():
             return
-        for instance_name in self._list_denovo_instances():
-            self.delete_instance(instance_name)
+        for instance_name in list(self._list_denovo_instances()):
+            self.gce_delete_instance(instance_name)
+
+    def _teardown_denovo_instances(self, max_parallel=20):
+        """ Delete all denovo instances, then their orphaned disks
+
+        All deletes run concurrently with at most max_parallel operations
+        in flight, and the inventory is updated once at the end. Returns
+        the names of the deleted instances.
+        """
+        if max_parallel < 1:
+            raise ValueError("max_parallel should be at least 1")
+        # the cache can miss instances created elsewhere since its refresh
+        self._updateNameToIPMap()
+        instance_names = sorted(self._list_denovo_instances())
+        results = self._delete_concurrently(
+            self.client.delete_instance, instance_names, max_parallel)
+        deleted = [name for name in instance_names
+                   if results[name] == "DELETED"]
+        # disks of deleted instances go with them, what is left unattached
+        # was left behind by failed creates
+        disk_results = self._delete_concurrently(
+            self.client.delete_disk, self._orphaned_denovo_disks(),
+            max_parallel)
+        self._forget_instances(deleted)
+
+        for name, outcome in sorted(results.items() + disk_results.items()):
+            if outcome != "DELETED":
+                print("{0}: {1}".format(name, outcome))
+        print("Deleted {0:d} of {1:d} instances and {2:d} of {3:d} orphaned "
+              "disks".format(len(deleted), len(instance_names),
+                             sum(1 for outcome in disk_results.values()
+                                 if outcome == "DELETED"),
+                             len(disk_results)))
+        self.logger.info("Operation stats: {0}".format(self.watcher.stats()))
+        return deleted
+
+    def _delete_concurrently(self, delete, names, max_parallel):
+        """ Run delete for names with at most max_parallel operations in flight
+
+        Returns a map of name to "DELETED" or the reason it failed.
+        """
+        results = {}
+        waiting = list(names)
+        active = set()
+
+        def fill():
+            batch = []
+            while waiting and len(active) < max_parallel:
+                name = waiting.pop(0)
+                active.add(name)
+                batch.append(name)
+            if not batch:
+                return
+            operations = self.client.wait_all([delete(key) for key in batch])
+            for name, operation in zip(batch, operations):
+                if isinstance(operation, HttpError):
+                    finish(name, "FAILED: {0}".format(operation))
+                elif isinstance(operation, Exception):
+                    raise operation
+                else:
+                    self.watcher.add(operation, callback=lambda operation,
+                                     name=name: on_done(name, operation))
+
+        def on_done(name, operation):
+            if 'error' in operation:
+                finish(name, "FAILED: " +
+                       GCEHelper._operation_error(operation))
+            else:
+                finish(name, "DELETED")
+
+        def finish(name, outcome):
+            results[name] = outcome
+            active.discard(name)
+            fill()
+
+        fill()
+        self.watcher.wait()
+        return results
+
+    def _orphaned_denovo_disks(self):
+        """ Names of denovo-N disks that no instance uses """
+        return [disk["name"] for disk in self.client.iter_items(
+                    self.client.list_disks, filter=self.denovo_filter,
+                    fields="items(name,users),nextPageToken")
+                if not disk.get("users")]
 
     def gce_delete_instance(self, instance_name):
         """ Deletes a particular instance by name """
 
         self.logger.info("Deleting instance : {:s}...".format(instance_name))
-        request = self.gce_service.instances().delete(
-            project=constants["PROJECT_ID"],
-            instance=instance_name,
-            zone=constants["DEFAULT_ZONE"]
-        )
-        response = request.execute(http=self.auth_http)
-        response = self._blocking_call(
-            self.gce_service, self.auth_http, response)
-
-    def _blocking_call(self, gce_service, auth_http, response):
+        response = self.client.delete_instance(instance_name).get()
+        response = self._blocking_call(response)
+        if 'error' not in response:
+            self._forget_instances([instance_name])
+
+    def _blocking_call(self, response):
         """Blocks until the operation status is done for the given operation."""
+        return self.watcher.wait_one(response)
 
-        status = response['status']
-        while status != 'DONE' and response:
-            operation_id = response['name']
-
-            # Identify if this is a per-zone resource
-            if 'zone' in response:
-                zone_name = response['zone'].split('/')[-1]
-                request = self.gce_service.zoneOperations().get(
-                    project=constants["PROJECT_ID"],
-                    operation=operation_id,
-                    zone=zone_name)
-            else:
-                request = self.gce_service.globalOperations().get(
-                    project=constants["PROJECT_ID"], operation=operation_id)
+    def gce_operation_stats(self):
+        """ Show poll, latency and failure counters of the operation watcher """
+        if self._watcher is None:
+            return
+        for key, val in sorted(self.watcher.stats().iteritems()):
+            print("{0}: {1}".format(key, val))
 
-            response = request.execute(http=self.auth_http)
-            if response:
-                status = response['status']
-        return response
+    @staticmethod
+    def _operation_error(operation):
+        """ Summarize the errors reported by a finished operation """
+        errors = operation.get('error', {}).get('errors', [])
+        return "; ".join(e.get('message', e.get('code', '')) for e in errors)
 
     @staticmethod
     def _get_instance_number(instance_name):
@@ -262,32 +632,63 @@ class GCEHelper(object):
         return number
 
     def _get_max_denovo_number(self):
-        """ Get the maximum number from the list of denovo instances"""
+        """ Get the maximum number from the list of denovo instances
+
+        This reads the inventory, refresh it first when numbering new ones.
+        """
         try :
             return max(GCEHelper._get_instance_number(e) for e in
                    self._list_denovo_instances())
         except ValueError:
             return 0
 
+    def _load_inventory(self):
+        """ Use the cached inventory if it is fresh, else fetch it """
+        records = self.inventory.load()
+        if records is None:
+            self._updateNameToIPMap()
+        else:
+            self._set_inventory(records)
+
+    def _set_inventory(self, records):
+        """ Set the instance list and the name/ip maps from records """
+        self._instances = records
+        self._nameToIPMap, self._IPtoNameMap = {}, {}
+        for record in records:
+            if record["natIP"] is None:
+                continue
+            self._nameToIPMap[record["name"]] = record["natIP"]
+            self._IPtoNameMap[record["natIP"]] = record["name"]
+
+    def _denovo_host_cores(self):
+        """ Map of running denovo instance name to its number of cores """
+        return dict((record["name"], machine_cores(record["machineType"]))
+                    for record in self.instances
+                    if 'denovo' in record["name"] and
+                    record["status"] == "RUNNING" and
+                    record["natIP"] is not None)
+
+    def _forget_instances(self, instance_names):
+        """ Drop deleted instances from the inventory in place """
+        instance_names = set(instance_names)
+        self.inventory.remove(instance_names)
+        self._set_inventory([rec for rec in self.instances
+                             if rec["name"] not in instance_names])
+
     def _updateNameToIPMap(self):
         self.logger.info("Updating name to ip map")
-        request = self.gce_service.instances(). list(
-            project=constants["PROJECT_ID"],
-            filter=None,
-            zone=constants["DEFAULT_ZONE"])
-        response = request.execute(http=self.auth_http)
-        self.nameToIPMap, self.IPtoNameMap = {},{}
-        if response and 'items' in response:
-            instances = response['items']
-            for instance in instances:
-                if len(instance["networkInterfaces"]) > 1:
-                    raise ValueError("Only one IP per instance expected")
-                net_interface = instance["networkInterfaces"][0]
-                if len(net_interface["accessConfigs"]) > 1:
-                    raise ValueError("Only one IP per instance expected")
-                access_config = net_interface["accessConfigs"][0]
-                self.nameToIPMap[instance["name"]] = access_config["natIP"]
-                self.IPtoNameMap[access_config["natIP"]] = instance["name"]
+        records = [InventoryCache.make_record(instance)
+                   for instance in self.client.iter_items(
+                       self.client.list_instances, filter=self.denovo_filter,
+                       fields=self.inventory_fields)]
+        self.inventory.save(records)
+        self._set_inventory(records)
+
+    def gce_refresh_inventory(self):
+        """ Refresh the cached instance inventory from GCE """
+        self._updateNameToIPMap()
+        for record in self.instances:
+            print("{name}: {status} {natIP} {machineType}".format(**record))
 
     def gce_list_name_ips(self):
         """ List all the name to ip maps """
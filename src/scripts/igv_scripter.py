@@ -1,3 +1,4 @@
+import gzip
 import random
 import os
 import sys
@@ -6,29 +7,179 @@ header_str = \
     """new
 load /usr/local/google/home/smoitra/denovo_experiments/trio_NA12878.xml
 snapshotDirectory /usr/local/google/home/smoitra/denovo_experiments/snapshots/{dirname}"""
+
+
+def open_calls(path):
+    """ Open a calls file, reading gzip compressed files directly """
+    with open(path, 'rb') as fin:
+        magic = fin.read(2)
+    if magic == '\x1f\x8b':
+        return gzip.open(path)
+    return open(path)
+
+
+def read_calls(fin):
+    """ Yield (chromosome, pos) from the comma separated lines of fin
+
+    Comment and header lines, and lines whose position is not a number,
+    are skipped.
+    """
+    for line in fin:
+        if line.startswith("#"):
+            continue
+        fields = line.strip().split(",")
+        if len(fields) >= 2 and fields[1].strip().isdigit():
+            yield fields[0], fields[1].strip()
+
+
+def reservoir_sample(calls, k, rng):
+    """ Uniformly sample k calls in one pass and constant memory """
+    sample = []
+    for seen, call in enumerate(calls):
+        if seen < k:
+            sample.append(call)
+        else:
+            idx = rng.randint(0, seen)
+            if idx < k:
+                sample[idx] = call
+    return sample
+
+
+def stratified_sample(calls, k, rng):
+    """ Sample k calls per chromosome, with one reservoir each """
+    reservoirs, seen = {}, {}
+    for call in calls:
+        chromosome = call[0]
+        count = seen.get(chromosome, 0)
+        seen[chromosome] = count + 1
+        if count < k:
+            reservoirs.setdefault(chromosome, []).append(call)
+        else:
+            idx = rng.randint(0, count)
+            if idx < k:
+                reservoirs[chromosome][idx] = call
+    return [call for chrom in sorted(reservoirs)
+            for call in reservoirs[chrom]]
+
+
+def chromosome_key(chromosome):
+    """ Sort key that puts chr2 before chr10 """
+    name = chromosome[3:] if chromosome.startswith("chr") else chromosome
+    return (0, int(name), "") if name.isdigit() else (1, 0, name)
+
+
+def sort_calls(calls):
+    """ Sort calls by chromosome and position """
+    return sorted(calls, key=lambda call: (chromosome_key(call[0]),
+                                           int(call[1])))
+
+
+def merge_loci(calls, window):
+    """ Merge sorted calls within window bases of the first call of a locus
+
+    Returns (chromosome, start, end) loci, one snapshot each.
+    """
+    loci = []
+    for chromosome, pos in calls:
+        pos = int(pos)
+        if loci and loci[-1][0] == chromosome and \
+                pos - loci[-1][1] <= window:
+            loci[-1][2] = max(loci[-1][2], pos)
+        else:
+            loci.append([chromosome, pos, pos])
+    return [tuple(locus) for locus in loci]
+
+
+def locus_str(chromosome, start, end):
+    """ IGV goto argument for a locus """
+    if start == end:
+        return "{0}:{1}".format(chromosome, start)
+    return "{0}:{1}-{2}".format(chromosome, start, end)
+
+
+def split_batches(loci, num_batches):
+    """ Split loci into contiguous batches so that each keeps its locality """
+    num_batches = max(1, min(num_batches, len(loci)))
+    size, extra = divmod(len(loci), num_batches)
+    batches, start = [], 0
+    for batch in xrange(num_batches):
+        end = start + size + (1 if batch < extra else 0)
+        batches.append(loci[start:end])
+        start = end
+    return batches
+
+
+def write_script(path, dirname, loci):
+    """ Write one IGV batch script that snapshots loci into dirname """
+    snapshot_dir = os.path.expanduser("~/denovo_experiments/snapshots/{dirname}".\
+                                      format(dirname=dirname))
+    if not os.path.exists(snapshot_dir):
+        os.makedirs(snapshot_dir)
+
+    with open(path, "w") as fout:
+        print >>fout, header_str.format(dirname=dirname)
+        for locus in loci:
+            print >>fout, "goto "+locus_str(*locus)
+            print >>fout, "collapse"
+            print >>fout, "snapshot"
+
 if __name__ == '__main__':
     from argparse import ArgumentParser
     parser = ArgumentParser(description="Generates IGV scripts")
-    parser.add_argument("--callsfile", type=str, help="File containing calls")
+    parser.add_argument("--callsfile", type=str,
+                        help="File containing calls, may be gzipped")
     parser.add_argument("--numrandom", type=int, default=50,
                         help="Number of calls to pick at random")
+    parser.add_argument("--per_chromosome", type=int, default=None,
+                        help="Pick this many calls per chromosome instead")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="Random seed, for reproducible snapshot sets")
+    parser.add_argument("--index", action="store_true",
+                        help="Sample through a binary index of the calls file")
+    parser.add_argument("--region", type=str, default=None,
+                        help="Only pick calls in chr:start-end, uses the index")
+    parser.add_argument("--sort", action="store_true",
+                        help="Visit calls in chromosome and position order")
+    parser.add_argument("--merge_window", type=int, default=None,
+                        help="Merge sorted calls this many bases apart into "
+                        "one snapshot")
+    parser.add_argument("--batches", type=int, default=1,
+                        help="Split into this many independent IGV scripts")
     parser.add_argument("--dirname", type=str, help="Directory to store images",
                         default="")
     args = parser.parse_args()
 
-    with open(args.callsfile) as fin:
-        calls = [line.strip().split(",")[:2] for line in fin]
-        random.shuffle(calls)
-        calls = calls[:args.numrandom]
-
-    snapshot_dir = os.path.expanduser("~/denovo_experiments/snapshots/{dirname}".\
-                                      format(dirname=args.dirname))
-    if not os.path.exists(snapshot_dir):
-        os.mkdir(snapshot_dir)
+    rng = random.Random(args.seed)
+    if args.index or args.region is not None:
+        from calls_index import CallsIndex, parse_region
+        with CallsIndex(args.callsfile) as index:
+            if args.region is not None:
+                calls = index.sample(args.numrandom, rng,
+                                     *parse_region(args.region))
+            elif args.per_chromosome is not None:
+                calls = index.stratified_sample(args.per_chromosome, rng)
+            else:
+                calls = index.sample(args.numrandom, rng)
+    else:
+        with open_calls(args.callsfile) as fin:
+            if args.per_chromosome is not None:
+                calls = stratified_sample(read_calls(fin),
+                                          args.per_chromosome, rng)
+            else:
+                calls = reservoir_sample(read_calls(fin), args.numrandom, rng)
+    if args.sort or args.merge_window is not None:
+        calls = sort_calls(calls)
+        loci = merge_loci(calls, args.merge_window or 0)
+    else:
+        rng.shuffle(calls)
+        loci = [(chromosome, pos, pos) for (chromosome, pos) in calls]
 
-    with open(os.path.expanduser("~/denovo_experiments/igv_commands.txt"), "w") as fout:
-        print >>fout, header_str.format(dirname=args.dirname)
-        for (chromosome, pos) in calls:
-            print >>fout, "goto "+chromosome+":"+pos
-            print >>fout, "collapse"
-            print >>fout, "snapshot"
+    if args.batches <= 1:
+        write_script(os.path.expanduser("~/denovo_experiments/igv_commands.txt"),
+                     args.dirname, loci)
+    else:
+        for batch, batch_loci in enumerate(split_batches(loci, args.batches)):
+            write_script(os.path.expanduser(
+                "~/denovo_experiments/igv_commands.{0:d}.txt".format(batch)),
+                os.path.join(args.dirname, "batch{0:d}".format(batch)),
+                batch_loci)
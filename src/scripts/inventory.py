@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+#
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except
+# in compliance with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the License
+# is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+# or implied. See the License for the specific language governing permissions and limitations under
+# the License.
+
+import json
+import os
+import time
+
+from utils import constants
+
+
+class InventoryCache(object):
+
+    """ On-disk cache of the GCE instance inventory with a time to live
+
+    Each instance is stored as a small record with its name, status, natIP
+    and machine type, which is everything the fabfile needs to build its
+    role definitions.
+    """
+
+    def __init__(self, path=None, ttl=None):
+        self.path = constants["INVENTORY_CACHE"] if path is None else path
+        self.ttl = constants["INVENTORY_TTL"] if ttl is None else float(ttl)
+
+    @staticmethod
+    def make_record(instance):
+        """ Reduce an instances().list item to an inventory record """
+        nat_ip = None
+        interfaces = instance.get("networkInterfaces", [])
+        if len(interfaces) > 1:
+            raise ValueError("Only one IP per instance expected")
+        if interfaces:
+            access_configs = interfaces[0].get("accessConfigs", [])
+            if len(access_configs) > 1:
+                raise ValueError("Only one IP per instance expected")
+            if access_configs:
+                nat_ip = access_configs[0].get("natIP")
+        return {
+            "name": instance["name"],
+            "status": instance.get("status"),
+            "natIP": nat_ip,
+            "machineType": instance.get("machineType", "").split('/')[-1],
+        }
+
+    def load(self):
+        """ Return the cached records, or None if missing or expired """
+        try:
+            with open(self.path) as fin:
+                cached = json.load(fin)
+        except (IOError, ValueError):
+            return None
+        if time.time() - cached.get("updated", 0) > self.ttl:
+            return None
+        return cached["instances"]
+
+    def save(self, records, updated=None):
+        """ Replace the cached records, stamped now unless updated is given """
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as fout:
+            json.dump({"updated": time.time() if updated is None else updated,
+                       "instances": records}, fout)
+        os.rename(tmp_path, self.path)
+
+    def invalidate(self):
+        """ Drop the cache so the next load goes to the API """
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def remove(self, names):
+        """ Remove instances from a fresh cache in place, keeping its age """
+        records = self.load()
+        if records is None:
+            return
+        with open(self.path) as fin:
+            updated = json.load(fin)["updated"]
+        names = set(names)
+        self.save([rec for rec in records if rec["name"] not in names],
+                  updated=updated)
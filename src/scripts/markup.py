@@ -32,6 +32,7 @@ except:
 # tags which are reserved python keywords will be referred 
 # to by a leading underscore otherwise we end up with a syntax error
 import keyword
+import re
 
 class element:
     """This class handles the addition of a new element."""
@@ -246,6 +247,21 @@ class page:
         """Add some text to the main part of the document"""
         self.content.append( text )
 
+    def addrows( self, rows, celltag='td', rowtag='tr' ):
+        """Add table rows in one go. The result is the same as calling
+        tr( ), td( row ) and tr.close( ) for every row, only faster."""
+
+        if rowtag not in self.twotags or celltag not in self.twotags or \
+                not ( self.class_ is None or isinstance( self.class_, basestring ) ):
+            for row in rows:
+                element( rowtag, case=self.case, parent=self )( )
+                element( celltag, case=self.case, parent=self )( row )
+                element( rowtag, case=self.case, parent=self ).close( )
+            return
+
+        template = _rowtemplate( celltag, rowtag, self.case, self.class_ )
+        template.render( rows, self.content )
+
 
     def init( self, lang='en', css=None, metainfo=None, title=None, header=None,
               footer=None, charset=None, encoding=None, doctype=None, bodyattrs=None, script=None, base=None ):
@@ -389,6 +405,48 @@ class _oneliner:
         
         return element( attr, case=self.case, parent=None )
 
+class _rowtemplate:
+    """Precompiled strings for rendering table rows, byte for byte the same
+    as the output of the element class for <tr> and <td> elements."""
+
+    def __init__( self, celltag='td', rowtag='tr', case='lower', class_=None ):
+        celltag = element( celltag, case=case ).tag
+        rowtag = element( rowtag, case=case ).tag
+        if class_ is None:
+            attrs = ''
+        else:
+            attrs = ' class="%s"' % escape( class_ )
+
+        self.rowopen = "<%s%s>" % ( rowtag, attrs )
+        self.rowclose = "</%s>" % rowtag
+        self.emptycell = "<%s%s>" % ( celltag, attrs )
+        self.cell = self.emptycell.replace( '%', '%%' ) + "%s" + "</%s>" % celltag
+
+    def render( self, rows, out=None ):
+        """Append the lines for all rows to out and return it."""
+
+        if out is None:
+            out = [ ]
+        append = out.append
+        rowopen, rowclose = self.rowopen, self.rowclose
+        emptycell, cell = self.emptycell, self.cell
+        for row in rows:
+            append( rowopen )
+            for value in _totuple( row ):
+                if value is None:
+                    append( emptycell )
+                else:
+                    append( cell % ( value, ) )
+            append( rowclose )
+        return out
+
+def tablerows( rows, celltag='td', rowtag='tr', case='lower', class_=None, separator='\n' ):
+    """Render a batch of table rows to a string, for writing large tables
+    out in pieces. Joined with the same separator the output is identical
+    to what markup.page produces for the same rows."""
+
+    return separator.join( _rowtemplate( celltag, rowtag, case, class_ ).render( rows ) )
+
 oneliner = _oneliner( case='lower' )
 upper_oneliner = _oneliner( case='upper' )
 given_oneliner = _oneliner( case='given' )
@@ -436,23 +494,22 @@ def _totuple( x ):
 
     return out
 
+_escapes = { '&' : '&amp;', '>' : '&gt;', '<' : '&lt;', '\"' : '&quot;', '\'' : '&quot;' }
+_escapes_newline = dict( _escapes )
+_escapes_newline[ '\n' ] = '<br>'
+_escape_re = re.compile( '[&><\"\']' )
+_escape_newline_re = re.compile( '[&><\"\'\n]' )
+
 def escape( text, newline=False ):
     """Escape special html characters."""
 
     if isinstance( text, basestring ):
-        if '&' in text:
-            text = text.replace( '&', '&amp;' )
-        if '>' in text:
-            text = text.replace( '>', '&gt;' )
-        if '<' in text:
-            text = text.replace( '<', '&lt;' )
-        if '\"' in text:
-            text = text.replace( '\"', '&quot;' )
-        if '\'' in text:
-            text = text.replace( '\'', '&quot;' )
         if newline:
-            if '\n' in text:
-                text = text.replace( '\n', '<br>' )
+            table, pattern = _escapes_newline, _escape_newline_re
+        else:
+            table, pattern = _escapes, _escape_re
+        if pattern.search( text ) is not None:
+            text = pattern.sub( lambda match: table[ match.group( ) ], text )
 
     return text
 
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+#
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except
+# in compliance with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the License
+# is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+# or implied. See the License for the specific language governing permissions and limitations under
+# the License.
+
+import logging
+import random
+import time
+
+from apiclient.errors import HttpError
+from apiclient.http import BatchHttpRequest
+
+from utils import constants
+
+
+class OperationWatcher(object):
+
+    """ Tracks pending GCE zone and global operations until they are done
+
+    All pending operations are polled together in batched HTTP requests,
+    with exponential backoff and jitter between rounds. Each operation has
+    its own deadline, after which it is reported as timed out. With a
+    ComputeClient the polls are concurrent requests on its pool instead.
+    """
+
+    # the API accepts at most this many calls in one batch request
+    max_batch_size = 100
+
+    def __init__(self, gce_service, auth_http, initial_delay=1.0,
+                 max_delay=30.0, backoff=2.0, jitter=0.25, timeout=900,
+                 client=None):
+        self.gce_service = gce_service
+        self.auth_http = auth_http
+        self.client = client
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.backoff = backoff
+        self.jitter = jitter
+        self.timeout = timeout
+        self.logger = logging.getLogger('operation_watcher')
+        self.logger.setLevel(logging.INFO)
+        # operation key -> [operation, callback, start time, deadline]
+        self.pending = {}
+        # finished operations not returned by wait yet
+        self.done = {}
+        self.delay = initial_delay
+        self.counters = {
+            "batches": 0,
+            "polls": 0,
+            "poll_errors": 0,
+            "completed": 0,
+            "failed": 0,
+            "timed_out": 0,
+            "total_latency": 0.0,
+            "max_latency": 0.0,
+        }
+
+    @staticmethod
+    def key(operation):
+        """ Unique key of an operation """
+        return operation.get('selfLink', operation['name'])
+
+    def add(self, operation, callback=None, timeout=None):
+        """ Start tracking an operation and return its key
+
+        Keyword arguments:
+        callback -- called with the final operation once it is done
+        timeout -- seconds before the operation is given up on
+        """
+        key = OperationWatcher.key(operation)
+        timeout = self.timeout if timeout is None else timeout
+        now = time.time()
+        self.pending[key] = [operation, callback, now, now + timeout]
+        # new work should be noticed quickly, so restart the backoff
+        self.delay = self.initial_delay
+        if operation.get('status') == 'DONE':
+            self._finish(key, operation)
+        return key
+
+    def wait(self, keys=None):
+        """ Block until the given (default all) operations are done
+
+        Returns a map of operation key to final operation. Operations added
+        by callbacks while waiting are waited on as well when keys is None.
+        Returned operations are forgotten, so each is returned once.
+        """
+        keys = None if keys is None else set(keys)
+
+        def outstanding():
+            if keys is None:
+                return bool(self.pending)
+            return any(key in self.pending for key in keys)
+
+        while outstanding():
+            self._sleep()
+            self._poll()
+
+        if keys is None:
+            done, self.done = self.done, {}
+            return done
+        return dict((key, self.done.pop(key)) for key in keys)
+
+    def wait_one(self, operation, timeout=None):
+        """ Block until a single operation is done and return it """
+        key = self.add(operation, timeout=timeout)
+        return self.wait([key])[key]
+
+    def stats(self):
+        """ Return a copy of the poll, latency and failure counters """
+        stats = dict(self.counters)
+        finished = stats["completed"] + stats["failed"] + stats["timed_out"]
+        stats["mean_latency"] = \
+            stats["total_latency"] / finished if finished else 0.0
+        stats["pending"] = len(self.pending)
+        return stats
+
+    def _sleep(self):
+        """ Sleep for the current backoff delay with jitter """
+        spread = self.delay * self.jitter
+        time.sleep(max(0.0, self.delay + random.uniform(-spread, spread)))
+        self.delay = min(self.max_delay, self.delay * self.backoff)
+
+    def _poll(self):
+        """ Poll every pending operation, in as few requests as possible """
+        now = time.time()
+        for key, (operation, _, _, deadline) in self.pending.items():
+            if now > deadline:
+                self.counters["timed_out"] += 1
+                self._finish(key, OperationWatcher._timed_out(operation))
+
+        keys = self.pending.keys()
+        if self.client is not None:
+            self._poll_concurrently(keys)
+            return
+        for start in xrange(0, len(keys), OperationWatcher.max_batch_size):
+            chunk = keys[start:start+OperationWatcher.max_batch_size]
+            batch = self._new_batch()
+            for idx, key in enumerate(chunk):
+                batch.add(self._get_request(self.pending[key][0]),
+                          callback=self._on_response,
+                          request_id=str(idx))
+            self._chunk = chunk
+            self.counters["batches"] += 1
+            self.counters["polls"] += len(chunk)
+            try:
+                batch.execute(http=self.auth_http)
+            except HttpError as e:
+                self.counters["poll_errors"] += len(chunk)
+                self.logger.warning("Batched operation poll failed: %s", e)
+
+    def _poll_concurrently(self, keys):
+        """ Poll operations with one concurrent request each """
+        self.counters["batches"] += 1
+        self.counters["polls"] += len(keys)
+        pending = [self.client.get_operation(self.pending[key][0])
+                   for key in keys]
+        for key, result in zip(keys, self.client.wait_all(pending)):
+            if isinstance(result, Exception):
+                self._handle_poll(key, None, result)
+            else:
+                self._handle_poll(key, result, None)
+
+    def _on_response(self, request_id, response, exception):
+        """ Batch callback for a single operation poll """
+        self._handle_poll(self._chunk[int(request_id)], response, exception)
+
+    def _handle_poll(self, key, response, exception):
+        """ Record the outcome of polling one operation """
+        if key not in self.pending:
+            return
+        if exception is not None:
+            self.counters["poll_errors"] += 1
+            status = getattr(getattr(exception, 'resp', None), 'status', None)
+            if status == 404:
+                operation = dict(self.pending[key][0])
+                operation['status'] = 'DONE'
+                operation['error'] = {'errors': [
+                    {'code': 'NOT_FOUND', 'message': str(exception)}]}
+                self._finish(key, operation)
+            return
+        if response.get('status') == 'DONE':
+            self._finish(key, response)
+        else:
+            self.pending[key][0] = response
+
+    def _finish(self, key, operation):
+        """ Record a finished operation and run its callback """
+        _, callback, started, _ = self.pending.pop(key)
+        latency = time.time() - started
+        self.counters["total_latency"] += latency
+        self.counters["max_latency"] = max(self.counters["max_latency"],
+                                           latency)
+        if 'error' not in operation:
+            self.counters["completed"] += 1
+        elif (operation['error'].get('errors') or [{}])[0].get('code') != \
+                'WATCHER_TIMEOUT':
+            self.counters["failed"] += 1
+        self.done[key] = operation
+        if callback is not None:
+            callback(operation)
+
+    def _new_batch(self):
+        """ Create a batch request bound to the compute service """
+        if hasattr(self.gce_service, 'new_batch_http_request'):
+            return self.gce_service.new_batch_http_request()
+        return BatchHttpRequest()
+
+    def _get_request(self, operation):
+        """ Build the get request for a zone or global operation """
+        if 'zone' in operation:
+            zone_name = operation['zone'].split('/')[-1]
+            return self.gce_service.zoneOperations().get(
+                project=constants["PROJECT_ID"],
+                operation=operation['name'],
+                zone=zone_name)
+        return self.gce_service.globalOperations().get(
+            project=constants["PROJECT_ID"], operation=operation['name'])
+
+    @staticmethod
+    def _timed_out(operation):
+        """ Mark an operation as given up on """
+        operation = dict(operation)
+        operation['status'] = 'DONE'
+        operation['error'] = {'errors': [
+            {'code': 'WATCHER_TIMEOUT',
+             'message': "Timed out waiting for " + operation['name']}]}
+        return operation
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+#
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except
+# in compliance with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the License
+# is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+# or implied. See the License for the specific language governing permissions and limitations under
+# the License.
+
+import copy
+import os
+from collections import namedtuple
+
+# hg19 / GRCh37 chromosome lengths, used to estimate how long a shard runs
+chromosome_lengths = {
+    "chr1": 249250621, "chr2": 243199373, "chr3": 198022430,
+    "chr4": 191154276, "chr5": 180915260, "chr6": 171115067,
+    "chr7": 159138663, "chr8": 146364022, "chr9": 141213431,
+    "chr10": 135534747, "chr11": 135006516, "chr12": 133851895,
+    "chr13": 115169878, "chr14": 107349540, "chr15": 102531392,
+    "chr16": 90354753, "chr17": 81195210, "chr18": 78077248,
+    "chr19": 59128983, "chr20": 63025520, "chr21": 48129895,
+    "chr22": 51304566, "chrX": 155270560, "chrY": 59373566,
+}
+
+
+class Shard(namedtuple("Shard", ["chromosome", "start", "end", "whole"])):
+
+    """ A piece of the genome handled by one job, start and end 1-based
+
+    whole is True when the shard is an entire chromosome.
+    """
+
+    @property
+    def cost(self):
+        """ Estimated cost of the shard, proportional to its length """
+        return self.end - self.start + 1
+
+    @property
+    def label(self):
+        """ Short name used in job names and output files """
+        if self.whole:
+            return self.chromosome
+        return "{0}_{1:d}-{2:d}".format(self.chromosome, self.start,
+                                        self.end)
+
+
+def load_lengths(inf):
+    """ Load chromosome lengths from a tab separated file (e.g. a .fai) """
+    lengths = {}
+    with open(inf) as fin:
+        for line in fin:
+            fields = line.split()
+            if len(fields) >= 2:
+                lengths[fields[0]] = int(fields[1])
+    return lengths
+
+
+def machine_cores(machine_type):
+    """ Number of cores of a machine type such as n1-standard-4 """
+    try:
+        return int(machine_type.rsplit("-", 1)[1])
+    except (IndexError, ValueError):
+        return 1
+
+
+class JobPlanner(object):
+
+    """ Expands a whole-genome job spec into shards and packs them onto hosts
+
+    Shards are assigned largest first to the host with the least estimated
+    work per core, so every host should finish at about the same time.
+    """
+
+    def __init__(self, opts, lengths=None):
+        self.opts = opts
+        self.lengths = chromosome_lengths if lengths is None else lengths
+
+    def chromosomes(self):
+        """ Chromosomes the spec covers, all of them if it names none """
+        if self.opts.get("chromosome"):
+            return self.opts["chromosome"].split(",")
+        return sorted(self.lengths, key=lambda c: -self.lengths[c])
+
+    def shards(self, region_size=None):
+        """ One shard per chromosome, or per region_size bases if given """
+        shards = []
+        for chromosome in self.chromosomes():
+            if chromosome not in self.lengths:
+                raise ValueError(
+                    "No length for chromosome {0}, give a lengths file that "
+                    "has it with the lengths option".format(chromosome))
+            length = self.lengths[chromosome]
+            step = length if region_size is None else int(region_size)
+            for start in xrange(1, length + 1, step):
+                shards.append(Shard(chromosome, start,
+                                    min(length, start + step - 1),
+                                    step >= length))
+        return shards
+
+    @staticmethod
+    def pack(shards, host_cores):
+        """ Assign shards to hosts, given a map of host name to cores
+
+        Returns a map of host name to its list of shards.
+        """
+        if not host_cores:
+            raise ValueError("No hosts to schedule shards on")
+        plan = dict((host, []) for host in host_cores)
+        load = dict((host, 0.0) for host in host_cores)
+        for shard in sorted(shards, key=lambda shard: -shard.cost):
+            host = min(host_cores, key=lambda host:
+                       (load[host] + shard.cost) / host_cores[host])
+            plan[host].append(shard)
+            load[host] += shard.cost
+        return plan
+
+    def shard_opts(self, shard):
+        """ Job options for a single shard """
+        opts = copy.deepcopy(self.opts)
+        opts["chromosome"] = shard.chromosome
+        if not shard.whole:
+            opts["start_position"] = str(shard.start)
+            opts["end_position"] = str(shard.end)
+        if opts.get("job_name"):
+            opts["job_name"] = "{0}-{1}".format(opts["job_name"], shard.label)
+        if opts.get("output_file"):
+            root, ext = os.path.splitext(opts["output_file"])
+            opts["output_file"] = "{0}.{1}{2}".format(root, shard.label, ext)
+        return opts
+
+    @staticmethod
+    def describe(plan, host_cores):
+        """ Print the plan, one line per host """
+        for host in sorted(plan):
+            cost = sum(shard.cost for shard in plan[host])
+            print "{0:<12} {1:>3d} cores {2:>12,d} bases/core: {3}".format(
+                host, host_cores[host], cost // host_cores[host],
+                " ".join(shard.label for shard in plan[host]))
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+#
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except
+# in compliance with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the License
+# is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+# or implied. See the License for the specific language governing permissions and limitations under
+# the License.
+
+
+class SlotScheduler(object):
+
+    """ Assigns queued jobs to hosts that have enough free cores
+
+    Every host has one slot per core and a job takes num_threads slots.
+    Jobs are considered in queue order. A job that fits nowhere yet is left
+    queued, and smaller jobs behind it may still be placed.
+    """
+
+    def __init__(self, host_cores, used_slots):
+        self.host_cores = dict(host_cores)
+        self.free = dict((host, cores - used_slots.get(host, 0))
+                         for (host, cores) in self.host_cores.items())
+
+    def slots_needed(self, threads):
+        """ Slots a job takes, capped so that it fits on the largest host """
+        threads = 1 if threads is None else max(1, int(threads))
+        return min(threads, max(self.host_cores.values()))
+
+    def assign(self, queued_jobs):
+        """ Place (job_id, threads) pairs, return a map of host to job ids """
+        assignment = {}
+        if not self.host_cores:
+            return assignment
+        for job_id, threads in queued_jobs:
+            needed = self.slots_needed(threads)
+            fits = [host for host in self.free if self.free[host] >= needed]
+            if not fits:
+                continue
+            # the emptiest host keeps load spread across the cluster
+            host = max(fits, key=lambda host: (self.free[host], host))
+            self.free[host] -= needed
+            assignment.setdefault(host, []).append(job_id)
+        return assignment
+
+    def free_slots(self):
+        """ Free slots per host after the assignments made so far """
+        return dict(self.free)
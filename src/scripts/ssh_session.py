@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+#
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except
+# in compliance with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the License
+# is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+# or implied. See the License for the specific language governing permissions and limitations under
+# the License.
+
+""" Persistent ssh sessions shared by fab invocations
+
+Commands go through OpenSSH connection multiplexing. The first command to a
+host starts a master connection in the background, and later commands, from
+this or any other fab process, open a channel on it instead of doing a new
+handshake. A master exits after SSH_PERSIST idle seconds.
+"""
+
+import glob
+import os
+import pipes
+import subprocess
+import threading
+
+from fabric.api import abort, env
+
+import utils
+
+
+def control_dir():
+    """ Directory of the master sockets, created on first use """
+    path = utils.constants["SSH_CONTROL_DIR"]
+    if not os.path.exists(path):
+        os.makedirs(path, 0700)
+    return path
+
+
+def ssh_options():
+    """ ssh options for a multiplexed session with fabric's identity """
+    options = ["-o", "StrictHostKeyChecking=no",
+               "-o", "UserKnownHostsFile=/dev/null", "-o", "LogLevel=ERROR",
+               "-o", "ControlMaster=auto",
+               "-o", "ControlPath=" + os.path.join(control_dir(), "%r@%h:%p"),
+               "-o", "ControlPersist={:d}".format(
+                   utils.constants["SSH_PERSIST"])]
+    keys = env.key_filename
+    if isinstance(keys, basestring):
+        keys = [keys]
+    for key in keys or []:
+        options += ["-i", key]
+    return options
+
+
+def ssh_command():
+    """ ssh command line for other tools such as rsync """
+    return " ".join(pipes.quote(arg) for arg in ["ssh"] + ssh_options())
+
+
+def _destination(host):
+    return "{0}@{1}".format(env.user, host)
+
+
+def _port_args():
+    return ["-p", str(env.port)] if env.port else []
+
+
+def mux_run(host, cmd, timeout=None):
+    """ Run cmd on host over its persistent session and return stdout
+
+    A failing command aborts like fabric's run, so inside the fleet
+    executor it fails only its host.
+    """
+    proc = subprocess.Popen(
+        ["ssh"] + ssh_options() + _port_args() + [_destination(host), cmd],
+        stdin=open(os.devnull), stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE)
+    timer = None
+    if timeout is None:
+        timeout = env.get("command_timeout")
+    if timeout:
+        timer = threading.Timer(float(timeout), proc.kill)
+        timer.start()
+    try:
+        out, err = proc.communicate()
+    finally:
+        if timer is not None:
+            timer.cancel()
+    if proc.returncode != 0:
+        abort("ssh {0} exited with {1:d}: {2}".format(
+            host, proc.returncode, err.strip() or cmd))
+    return out.rstrip("\n")
+
+
+def quick_run(cmd):
+    """ mux_run on the current fabric host """
+    return mux_run(env.host, cmd)
+
+
+def _control(host, op):
+    """ Send a control command (check or exit) to the master of host """
+    proc = subprocess.Popen(
+        ["ssh"] + ssh_options() + _port_args() +
+        ["-O", op, _destination(host)],
+        stdin=open(os.devnull), stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE)
+    proc.communicate()
+    return proc.returncode == 0
+
+
+def socket_path(host):
+    """ Master socket of host, as ControlPath expands it """
+    return os.path.join(control_dir(), "{0}@{1}:{2}".format(
+        env.user, host, env.port or 22))
+
+
+def check(host):
+    """ True if host has a live master, stale sockets are removed """
+    path = socket_path(host)
+    if not os.path.exists(path):
+        return False
+    if _control(host, "check"):
+        return True
+    # the master died without cleaning up, the next command starts anew
+    os.remove(path)
+    return False
+
+
+def close(host):
+    """ Stop the master of host, True if one was running """
+    return check(host) and _control(host, "exit")
+
+
+def open_hosts():
+    """ Hosts that have a master socket """
+    hosts = []
+    for path in glob.glob(os.path.join(control_dir(), "*@*:*")):
+        host = os.path.basename(path).split("@", 1)[1].rsplit(":", 1)[0]
+        hosts.append(host)
+    return sorted(hosts)
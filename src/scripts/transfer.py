@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+#
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except
+# in compliance with the License. You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the License
+# is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+# or implied. See the License for the specific language governing permissions and limitations under
+# the License.
+
+import hashlib
+import json
+import os
+import pipes
+import tempfile
+
+from fabric.api import env, hide, local, run
+
+import ssh_session
+
+
+def local_checksum(path, block_size=1 << 20):
+    """ sha256 of a local file """
+    digest = hashlib.sha256()
+    with open(path, "rb") as fin:
+        for block in iter(lambda: fin.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def remote_checksums(files):
+    """ sha256 of files on the current host, missing files are left out """
+    if not files:
+        return {}
+    cmd = "sha256sum -- " + " ".join(pipes.quote(f) for f in files) +\
+        " 2>/dev/null || true"
+    checksums = {}
+    with hide('output'):
+        for line in run(cmd).splitlines():
+            fields = line.strip().split(None, 1)
+            if len(fields) == 2:
+                checksums[fields[1].lstrip("*")] = fields[0]
+    return checksums
+
+
+def rsync_from_host(host, files, local_dir):
+    """ Pull files, absolute or relative to the remote home, from host
+
+    All files come over one compressed rsync stream. Partial transfers are
+    kept and resumed on the next call, and rsync verifies what it appends.
+    """
+    if not os.path.exists(local_dir):
+        os.makedirs(local_dir)
+    # --files-from paths are relative to the source directory, so absolute
+    # paths are fetched from / and land under local_dir the same way
+    for source_dir, group in (
+            ("", [f for f in files if not os.path.isabs(f)]),
+            ("/", [f.lstrip("/") for f in files if os.path.isabs(f)])):
+        if not group:
+            continue
+        with tempfile.NamedTemporaryFile(prefix="files-") as file_list:
+            file_list.write("\n".join(group) + "\n")
+            file_list.flush()
+            local("rsync -z --partial --append-verify --files-from={0} "
+                  "-e {1} {2}@{3}:{4} {5}".format(
+                      pipes.quote(file_list.name),
+                      pipes.quote(ssh_session.ssh_command()),
+                      env.user, host, source_dir, pipes.quote(local_dir)))
+
+
+def fetch_verified(files, local_dir):
+    """ Fetch files from the current host and verify them by checksum
+
+    Returns a map of file to its checksum for the files that arrived
+    intact. Files that do not match are removed so the next call fetches
+    them again.
+    """
+    expected = remote_checksums(files)
+    if not expected:
+        return {}
+    rsync_from_host(env.host, sorted(expected), local_dir)
+    verified = {}
+    for name, checksum in expected.items():
+        path = os.path.join(local_dir, name.lstrip("/"))
+        if not os.path.exists(path):
+            continue
+        if local_checksum(path) == checksum:
+            verified[name] = checksum
+        else:
+            print "Checksum mismatch, removing {0}".format(path)
+            os.remove(path)
+    return verified
+
+
+class Manifest(object):
+
+    """ Json record of files that were fetched and verified """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path) as fin:
+                self.entries = json.load(fin)
+
+    def has(self, key, local_path):
+        """ True if key was verified and its local copy still exists """
+        return key in self.entries and os.path.exists(local_path)
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        with open(self.path + ".tmp", "w") as fout:
+            json.dump(self.entries, fout, indent=1, sort_keys=True)
+        os.rename(self.path + ".tmp", self.path)
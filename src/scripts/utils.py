@@ -11,7 +11,22 @@ constants = {
         '~/.store/genomics_denovo_caller/oauth2.dat'),
     "GCE_SCOPE": 'https://www.googleapis.com/auth/compute',
     "SNAPSHOT_NAME": "denovo-snapshot",
-    "JOB_TABLE": os.path.expanduser("~/.denovo_experiments/jobs.tbl")
+    "JOB_TABLE": os.path.expanduser("~/.denovo_experiments/jobs.tbl"),
+    "INVENTORY_CACHE": os.path.expanduser(
+        "~/.denovo_experiments/inventory.json"),
+    "INVENTORY_TTL": 300,
+    "DISCOVERY_CACHE": os.path.expanduser(
+        "~/.denovo_experiments/compute-discovery.json"),
+    "REMOTE_LOG_DIR": "denovo-logs",
+    "LOCAL_LOG_DIR": os.path.expanduser("~/.denovo_experiments/logs"),
+    "LOCAL_OUTPUT_DIR": os.path.expanduser("~/.denovo_experiments/outputs"),
+    "SSH_CONTROL_DIR": os.path.expanduser("~/.denovo_experiments/ssh"),
+    "SSH_PERSIST": 600,
+    # seconds after which a job still starting is taken to have failed
+    "STARTING_TIMEOUT": 600,
+    # e.g. http://localhost:8080/compute/v1/projects/ for a stub server
+    "COMPUTE_BASE_URL": os.environ.get("DENOVO_COMPUTE_URL"),
+    "COMPUTE_MAX_CONCURRENCY": 16
 }
 constants["GCE_URL"] = 'https://www.googleapis.com/compute/{API_VERSION}/projects/'.format(**constants)
 
@@ -33,6 +48,12 @@ def confirm(prompt="Are you sure?"):
             print prompt
             continue
 
+def str_to_bool(value):
+    """ Interpret a fab task argument such as "True" or "no" as a bool """
+    if isinstance(value, basestring):
+        return value.strip().lower() in ("1", "true", "t", "yes", "y")
+    return bool(value)
+
 def print_iterable(iterable):
     for e in iterable:
         print e